@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+announcements.py -- the cached conference and featured speaker announcements
+
+Kept apart from conference.py so the cron and task handlers that refresh
+them don't import the endpoints API to do so.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED SPEAKER"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+
+
+def cacheAnnouncement():
+    """Create Announcement & assign to memcache; used by
+    memcache cron job & putAnnouncement().
+    """
+    confs = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable > 0)
+    ).fetch(projection=[Conference.name])
+
+    if confs:
+        # If there are almost sold out conferences,
+        # format announcement and set it in memcache
+        announcement = ANNOUNCEMENT_TPL % (
+            ', '.join(conf.name for conf in confs))
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    else:
+        # If there are no sold out conferences,
+        # delete the memcache announcements entry
+        announcement = ""
+        memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+
+    return announcement
+
+
+def setFeaturedSpeaker(speaker, wsck):
+    """
+        After creating a new session in a conference, the speaker is
+        checked. If there is more than one session by this speaker at this
+        conference, a Memcache entry is created/updated with the speaker
+        and session names.
+
+    Params:
+        - speaker: the speaker that was just added to the conference
+        - wsck: the websafeConferenceKey representing a URL safe id for the
+                conference the speaker is speaking at
+    Returns: nothing
+    """
+    conf = ndb.Key(urlsafe=wsck).get()
+    sessions = Session.query(ancestor=conf.key)
+    sessions_by_speaker = sessions.filter(
+            Session.speaker == speaker
+    ).fetch(
+            projection=[Session.name]
+    )
+
+    if len(sessions_by_speaker) > 1:
+        text_base = ('Featured Speaker {0} Speaking at '
+                     'the following sessions: {1}, at the {2} conference')
+        announcement = text_base.format(
+                speaker,
+                ', '.join(session.name for session in sessions_by_speaker),
+                conf.name)
+        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, announcement)
+    # Otherwise, leave the featured speaker as is.
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py -- load-test ConferenceApi against the local App Engine stubs
+
+Seeds the testbed datastore/memcache/taskqueue stubs with a datagen.py
+dataset of Profiles, Conferences and Sessions, drives ConferenceApi methods
+directly and reports throughput, p50/p99 latency and RPC counts per
+scenario. Every iteration starts cold: the ndb context cache, the local LRU
+of cache.py and memcache are cleared first, so each one reads through to
+the stubs. Results can be saved as a baseline and later runs compared
+against it:
+
+    $ python benchmark.py --sdk ~/google-cloud-sdk/platform/google_appengine \\
+          --save-baseline benchmark_baseline.json
+    $ python benchmark.py --baseline benchmark_baseline.json
+
+The SDK path can also be given with the APPENGINE_SDK environment variable.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+
+def setupPaths(sdk):
+    """Put the App Engine SDK and its bundled libraries on sys.path."""
+    if sdk:
+        sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def activateTestbed():
+    """Activate the datastore, memcache, taskqueue and mail stubs."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id='conference-benchmark', overwrite=True)
+    tb.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=os.path.dirname(
+        os.path.abspath(__file__)))
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+    return tb
+
+
+class RpcCounter(object):
+    """Counts the RPCs made while active, per service."""
+
+    def __init__(self):
+        from google.appengine.api import apiproxy_stub_map
+        self.counts = {}
+        self.active = False
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'benchmark', self._hook)
+
+    def _hook(self, service, call, request, response):
+        if self.active:
+            self.counts[service] = self.counts.get(service, 0) + 1
+
+    def reset(self):
+        self.counts = {}
+
+
+def actAs(email):
+    """Make endpoints.get_current_user() return the given user."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+
+
+def benchUser(i):
+    """Return a user id outside the generated dataset."""
+    return 'bench%d@example.com' % i
+
+
+def seed(args):
+    """Write the benchmark dataset with datagen and return it."""
+    import datagen
+    return datagen.generate(datagen.Config(
+        profiles=args.profiles,
+        conferences=args.conferences,
+        sessions=args.sessions,
+        hot_conferences=args.hot_conferences,
+        hot_registrants=args.hot_registrants,
+        wishlist_users=args.wishlist_users,
+        wishlist_length=args.wishlist_length,
+        seed=args.seed))
+
+
+def scenarios(api, dataset, rng, wishlist_users):
+    """
+        Return (name, callable) pairs; each callable performs one iteration
+        of its scenario, given the iteration number.
+    """
+    import conference
+    import datagen
+    import validation
+    from models import ConferenceQueryForm
+    from models import ConferenceQueryForms
+
+    CONF_GET = conference.CONF_GET_REQUEST.combined_message_class
+    CONF_NEARBY = conference.CONF_NEARBY_REQUEST.combined_message_class
+    CONF_REGISTER = conference.CONF_REGISTER_REQUEST.combined_message_class
+    SESSION_POST = conference.SESSION_POST_REQUEST.combined_message_class
+    WISHLIST = conference.SESSION_WISHLIST_REQUEST.combined_message_class
+    conf_keys = [k.urlsafe() for k in dataset.conference_keys]
+    hot_keys = [k.urlsafe() for k in dataset.hot_conference_keys] or conf_keys
+    session_keys = [k.urlsafe() for k in dataset.session_keys]
+
+    def query(i):
+        api.queryConferences(ConferenceQueryForms(filters=[
+            ConferenceQueryForm(field='CITY', operator='EQ',
+                                value=datagen.CITIES[0])]))
+
+    def nearby(i):
+        # "near me" from somewhere in one of the popular cities
+        latitude, longitude = datagen.CITY_COORDINATES[
+                datagen.CITIES[i % 3]]
+        api.searchConferencesNearby(CONF_NEARBY(
+            latitude=latitude + rng.uniform(-0.1, 0.1),
+            longitude=longitude + rng.uniform(-0.1, 0.1),
+            radiusKm=10))
+
+    def register(i):
+        # registration opening on a hot conference
+        actAs(benchUser(i))
+        # with an idempotency key, as the web client sends
+        request = CONF_REGISTER(websafeConferenceKey=rng.choice(hot_keys),
+                                idempotencyKey='bench%d' % i)
+        api.registerForConference(request)
+        api.unregisterFromConference(request)
+
+    def createSession(i):
+        conf_key = rng.choice(dataset.conference_keys)
+        actAs(dataset.organizer(conf_key))
+        api.createSession(SESSION_POST(
+            websafeConferenceKey=conf_key.urlsafe(),
+            name='Benchmark session %d' % i,
+            duration=60, start_time=1000, date='2016-06-01'))
+
+    def wishlist(i):
+        actAs(benchUser(i))
+        request = WISHLIST(websafeSessionKey=rng.choice(session_keys))
+        api.addSessionToWishlist(request)
+        api.removeSessionFromWishlist(request)
+
+    def schedule(i):
+        # the users with long wishlists looking at a hot conference
+        actAs(datagen.userId(i % max(1, wishlist_users)))
+        api.getConferenceSessionSchedule(
+            CONF_GET(websafeConferenceKey=rng.choice(hot_keys)))
+
+    # a bulk ingestion sized column of session times and dates
+    times = [rng.randint(0, 2400) for _ in range(1000)]
+    dates = ['2016-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 31))
+             for _ in range(1000)]
+
+    def validate(i):
+        validation.normalizeTimes(times)
+        validation.parseDates(dates)
+
+    return [('queryConferences', query),
+            ('searchConferencesNearby', nearby),
+            ('registerForConference', register),
+            ('createSession', createSession),
+            ('wishlist', wishlist),
+            ('getConferenceSessionSchedule', schedule),
+            ('validateSessionColumns', validate)]
+
+
+def coldStart():
+    """Drop the ndb context cache, the local LRU and memcache, so an
+    iteration reads through to the stubs like the first one did."""
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    import cache
+    ndb.get_context().clear_cache()
+    cache.local.clear()
+    memcache.flush_all()
+
+
+def measure(scenario, iterations, counter):
+    """
+        Run a scenario from a cold start each iteration.
+
+    :return: (latencies in ms, RPC counts per service) per iteration
+    """
+    latencies = []
+    rpcs = []
+    for i in range(iterations):
+        coldStart()
+        counter.reset()
+        counter.active = True
+        t0 = time.time()
+        scenario(i)
+        latencies.append((time.time() - t0) * 1000)
+        counter.active = False
+        rpcs.append(counter.counts)
+    return latencies, rpcs
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(args):
+    """Seed the stubs, run every scenario and return the results."""
+    setupPaths(args.sdk or os.environ.get('APPENGINE_SDK'))
+    tb = activateTestbed()
+    try:
+        from conference import ConferenceApi
+        dataset = seed(args)
+        rng = random.Random(args.seed)
+        api = ConferenceApi()
+        counter = RpcCounter()
+
+        results = {}
+        for name, scenario in scenarios(api, dataset, rng,
+                                        args.wishlist_users):
+            if args.only and name not in args.only:
+                continue
+            latencies, rpcs = measure(scenario, args.iterations, counter)
+            totals = {}
+            for counts in rpcs:
+                for service, count in counts.items():
+                    totals[service] = totals.get(service, 0) + count
+            results[name] = {
+                'iterations': args.iterations,
+                'throughput_per_s': args.iterations / max(
+                    sum(latencies) / 1000, 1e-6),
+                'p50_ms': percentile(latencies, 0.5),
+                'p99_ms': percentile(latencies, 0.99),
+                'rpcs_per_iteration': dict(
+                    (service, count / float(args.iterations))
+                    for service, count in totals.items()),
+            }
+        return results
+    finally:
+        tb.deactivate()
+
+
+def compare(results, baseline, tolerance):
+    """
+        Return the regressions of results against a baseline: latencies more
+        than tolerance slower, or more RPCs per iteration.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append('%s %s: %.2f -> %.2f' % (
+                    name, metric, base[metric], result[metric]))
+        for service, count in result['rpcs_per_iteration'].items():
+            before = base['rpcs_per_iteration'].get(service, 0)
+            if count > before + 1e-9:
+                regressions.append('%s %s RPCs: %.2f -> %.2f' % (
+                    name, service, before, count))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sdk', help='path to the App Engine SDK')
+    parser.add_argument('--profiles', type=int, default=2000)
+    parser.add_argument('--conferences', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=20,
+                        help='sessions per conference')
+    parser.add_argument('--hot-conferences', type=int, default=3)
+    parser.add_argument('--hot-registrants', type=int, default=1500,
+                        help='registrants per hot conference')
+    parser.add_argument('--wishlist-users', type=int, default=50)
+    parser.add_argument('--wishlist-length', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', action='append',
+                        help='only run the named scenario (repeatable)')
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='fail on regressions against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed latency slowdown, as a fraction')
+    args = parser.parse_args()
+
+    results = run(args)
+    for name, result in sorted(results.items()):
+        print('%-30s %8.1f/s  p50 %7.2fms  p99 %7.2fms  rpcs %s' % (
+            name, result['throughput_per_s'], result['p50_ms'],
+            result['p99_ms'], json.dumps(result['rpcs_per_iteration'],
+                                         sort_keys=True)))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
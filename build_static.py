@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""
+build_static.py -- bundle, minify and fingerprint the web client
+
+Concatenates the local stylesheets and the Angular scripts into one CSS and
+one JS bundle, inlines every static/partials template into the Angular
+$templateCache (so routes and modals need no extra request), minifies both
+and names each bundle after a hash of its content. The bundles go to
+static/dist together with a copy of templates/index.html whose
+<!-- build:css --> and <!-- build:js --> blocks point at them. Because a
+changed file gets a new name, app.yaml can serve /dist with a far-future
+expiration. Rebuild after changing anything under static/js,
+static/partials, static/bootstrap/css or templates/index.html:
+
+    $ python build_static.py
+
+Only the standard library is needed.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE_HTML = os.path.join(ROOT, 'templates', 'index.html')
+DIST = os.path.join(ROOT, 'static', 'dist')
+DIST_URL = '/dist/'
+ANGULAR_MODULE = 'conferenceApp'
+
+# url path -> file, in load order
+CSS_FILES = [
+    ('/css/bootstrap-cosmo.css', 'static/bootstrap/css/bootstrap-cosmo.css'),
+    ('/css/main.css', 'static/bootstrap/css/main.css'),
+    ('/css/offcanvas.css', 'static/bootstrap/css/offcanvas.css'),
+]
+JS_FILES = ['static/js/app.js', 'static/js/controllers.js']
+PARTIALS = ('static/partials', '/partials/')
+
+BUILD_BLOCK = re.compile(
+        r'[ \t]*<!-- build:(css|js) -->.*?<!-- endbuild -->', re.S)
+# characters after which a '/' starts a regular expression, not a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^\n')
+REGEX_KEYWORDS = re.compile(r'\b(return|typeof|case|in)$')
+
+
+def _read(path):
+    with open(os.path.join(ROOT, path), 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+def minifyJs(source):
+    """
+        Remove comments and indentation from JavaScript. Strings and
+        regular expression literals are copied verbatim and line breaks are
+        kept, so automatic semicolon insertion is unaffected.
+    """
+    out = []
+    i = 0
+    n = len(source)
+    last = '\n'     # last significant character written
+    while i < n:
+        c = source[i]
+        if c in '\'"':
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == '\\' else 1
+            out.append(source[i:j + 1])
+            last = c
+            i = j + 1
+        elif source.startswith('//', i):
+            i = source.find('\n', i)
+            i = n if i < 0 else i
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+        elif c == '/' and (last in REGEX_PRECEDERS or REGEX_KEYWORDS.search(
+                ''.join(out[-7:]).rstrip())):
+            j = i + 1
+            in_class = False
+            while j < n and (in_class or source[j] != '/'):
+                if source[j] == '\\':
+                    j += 1
+                elif source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                j += 1
+            j += 1
+            while j < n and source[j].isalpha():    # flags
+                j += 1
+            out.append(source[i:j])
+            last = '/'
+            i = j
+        elif c == '\n':
+            # drop trailing blanks and empty lines
+            while out and out[-1] in (' ', '\t'):
+                out.pop()
+            if out and out[-1] != '\n':
+                out.append('\n')
+            last = '\n'
+            i += 1
+            while i < n and source[i] in ' \t':
+                i += 1
+        else:
+            out.append(c)
+            if not c.isspace():
+                last = c
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def minifyCss(source):
+    """Remove comments and collapse whitespace in a stylesheet."""
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = re.sub(r':\s+', ':', source)
+    return source.replace(';}', '}').strip() + '\n'
+
+
+def absoluteUrls(css, url_path):
+    """Rewrite the relative url()s of a stylesheet served from url_path."""
+    base = url_path.rsplit('/', 1)[0] + '/'
+
+    def resolve(match):
+        quote, url = match.group(1), match.group(2)
+        if re.match(r'^(/|[a-z]+:|data:|#)', url):
+            return match.group(0)
+        return 'url(%s%s%s)' % (quote, os.path.normpath(base + url), quote)
+    return re.sub(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)', resolve, css)
+
+
+def templateCacheJs():
+    """Return a script putting every partial into the $templateCache."""
+    directory, url = PARTIALS
+    puts = []
+    for path in sorted(glob.glob(os.path.join(ROOT, directory, '*.html'))):
+        name = os.path.basename(path)
+        html = _read(os.path.join(directory, name))
+        puts.append('$templateCache.put(%s, %s);' % (
+                json.dumps(url + name), json.dumps(html)))
+    return ("angular.module('%s').run(['$templateCache', "
+            "function ($templateCache) {\n%s\n}]);\n" % (
+                ANGULAR_MODULE, '\n'.join(puts)))
+
+
+def _fingerprint(name, ext, content):
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:10]
+    return '%s.%s.%s' % (name, digest, ext)
+
+
+def build():
+    """Write the bundles and index.html to static/dist; return the names."""
+    css = ''.join(minifyCss(absoluteUrls(_read(path), url))
+                  for url, path in CSS_FILES)
+    # app.js defines the module, so the templates go right after it
+    scripts = [_read(JS_FILES[0]), templateCacheJs()] + \
+        [_read(path) for path in JS_FILES[1:]]
+    js = ''.join(minifyJs(script) for script in scripts)
+
+    if not os.path.isdir(DIST):
+        os.makedirs(DIST)
+    for stale in glob.glob(os.path.join(DIST, 'app.*')):
+        os.remove(stale)
+    names = {'css': _fingerprint('app', 'css', css),
+             'js': _fingerprint('app', 'js', js)}
+    for kind, content in (('css', css), ('js', js)):
+        with open(os.path.join(DIST, names[kind]), 'wb') as f:
+            f.write(content.encode('utf-8'))
+
+    tags = {
+        'css': '    <link rel="stylesheet" href="%s%s">' % (DIST_URL,
+                                                          names['css']),
+        'js': '<script src="%s%s"></script>' % (DIST_URL, names['js']),
+    }
+    html = BUILD_BLOCK.sub(lambda match: tags[match.group(1)],
+                           _read(SOURCE_HTML))
+    with open(os.path.join(DIST, 'index.html'), 'wb') as f:
+        f.write(html.encode('utf-8'))
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.parse_args()
+    for kind, name in sorted(build().items()):
+        size = os.path.getsize(os.path.join(DIST, name))
+        print('%-4s %s (%d bytes)' % (kind, name, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""
+cache.py -- read-through cache for hot conference and session reads
+
+Values live in memcache together with the time their computation took and a
+soft expiry. In front of memcache every instance keeps a small LRU with a
+short TTL. On a miss only the request holding the memcache lock recomputes
+the value; the others serve the stale value or wait for the winner. To keep
+popular keys from all expiring at once, a request may refresh a value early,
+with a probability that grows as its expiry nears (XFetch), so only one
+recompute per key reaches the datastore.
+
+"""
+
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+
+MEMCACHE_CONFERENCE_KEY = "CONFERENCE:%s"
+CONFERENCE_TTL = 30     # conference forms show seatsAvailable, keep it short
+LOCK_KEY = "LOCK:%s"
+LOCK_TTL = 10           # seconds a recompute may hold the lock
+WAIT_INTERVAL = 0.05    # seconds between polls while another request
+WAIT_ATTEMPTS = 40      # recomputes a value nobody has yet
+BETA = 1.0              # > 1 favours earlier refreshes
+
+
+class LocalLRU(object):
+    """A thread-safe in-instance LRU cache whose entries expire."""
+
+    def __init__(self, capacity=500, ttl=5):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                return None
+            self._entries[key] = entry  # most recently used goes last
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local = LocalLRU()
+
+
+def _envelope(value, delta, ttl):
+    return (value, delta, time.time() + ttl)
+
+
+def _fresh(envelope):
+    """XFetch: whether a cached envelope may still be served as is."""
+    value, delta, expiry = envelope
+    return time.time() - delta * BETA * math.log(1 - random.random()) < expiry
+
+
+def getOrCompute(key, compute, ttl=60):
+    """
+        Return the cached value of key, computing it at most once across
+        instances when it is missing or due for a refresh.
+
+    :param key: memcache key of the value
+    :param compute: callable returning the value; it must not return None
+    :param ttl: seconds the value stays fresh; memcache keeps it twice as
+                long so it can be served stale during a recompute
+    :return: the value
+    """
+    value = local.get(key)
+    if value is not None:
+        return value
+
+    client = memcache.Client()
+    envelope = client.gets(key)
+    if envelope is not None and _fresh(envelope):
+        local.set(key, envelope[0])
+        return envelope[0]
+
+    if client.add(LOCK_KEY % key, 1, time=LOCK_TTL):
+        try:
+            start = time.time()
+            value = compute()
+            new = _envelope(value, time.time() - start, ttl)
+            # cas fails if the key was invalidated (deleted) or rewritten
+            # meanwhile, in which case our value may already be stale
+            if envelope is not None:
+                client.cas(key, new, time=ttl * 2)
+            else:
+                client.add(key, new, time=ttl * 2)
+        finally:
+            client.delete(LOCK_KEY % key)
+        local.set(key, value)
+        return value
+
+    # someone else is recomputing: serve stale or wait for the winner
+    if envelope is not None:
+        return envelope[0]
+    for _ in range(WAIT_ATTEMPTS):
+        time.sleep(WAIT_INTERVAL)
+        envelope = client.get(key)
+        if envelope is not None:
+            local.set(key, envelope[0])
+            return envelope[0]
+    logging.warning('Gave up waiting for %s to be recomputed', key)
+    return compute()
+
+
+def put(key, value, ttl=60):
+    """Store a value that was just computed by a writer."""
+    memcache.set(key, _envelope(value, 0, ttl), time=ttl * 2)
+    local.set(key, value)
+
+
+def invalidate(key):
+    """
+        Drop a value so the next read recomputes it. Other instances may
+        serve their local copy until its short TTL runs out.
+    """
+    local.delete(key)
+    memcache.delete(key)
+
+
+def invalidateConference(wsck):
+    """Drop the cached ConferenceForm of a conference."""
+    invalidate(MEMCACHE_CONFERENCE_KEY % wsck)
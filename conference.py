@@ -12,54 +12,112 @@ created by wesc on 2014 apr 21
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import httplib
+import time
 from datetime import datetime
+from datetime import timedelta
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 
-from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
 from models import BooleanMessage
+from models import WishlistForm
+from models import WishlistForms
+from models import WishlistOpForms
+from models import WaitlistEntry
+from models import WaitlistForm
+from models import BatchRequestForms
+from models import BatchResponseForm
+from models import BatchResponseForms
+from models import SessionConflictForm
+from models import SessionConflictForms
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForms
+from models import DEFAULTS_CONF
 from models import TeeShirtSize
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionSearchForm
+from models import SessionSyncForm
+from models import SessionTombstone
 from models import TypeOfSession
+from models import syncTimestamp
+from models import typeHourBucket
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
+from announcements import MEMCACHE_ANNOUNCEMENTS_KEY
+from announcements import MEMCACHE_FEATURED_SPEAKER_KEY
+from instrumentation import instrumented
+import cache
+from forms import conferenceForm
+import mapper
+from recommendations import getRecommended
+from schedule import getSchedule
+from schedule import rebuildSchedule
+import seatpush
+from tombstones import oldestSyncToken
 from utils import getUserId, validateTime
+import geo
+from validation import parseDate
+import upcoming
+import waitlist
+import wishlist
+
+class ConflictException(endpoints.ServiceException):
+    """ConflictException -- exception mapped to HTTP 409 response"""
+    http_status = httplib.CONFLICT
+
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED SPEAKER"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-
-DEFAULTS_CONF = {
-    "city": "Default City",
-    "maxAttendees": 0,
-    "seatsAvailable": 0,
-    "topics": ["Default", "Topic"],
+MEMCACHE_IDEMPOTENCY_KEY = "IDEMPOTENCY:%s:%s:%s:%s"
+IDEMPOTENCY_TTL = 10 * 60  # seconds a result is replayed for retries
+IDEMPOTENCY_PENDING = "PENDING"
+IDEMPOTENCY_WAIT = 5            # seconds a retry waits for the first run
+IDEMPOTENCY_POLL_INTERVAL = 0.25
+UPCOMING_MAX_HOURS = 24
+UPCOMING_MAX_SESSIONS = 500
+NEARBY_MAX_RADIUS_KM = 500
+NEARBY_MAX_RESULTS = 100
+MAX_BATCH = 20
+# sync tokens stay this far (microseconds) behind the clock, so a write
+# stamped by an instance whose clock lags, or committed after its stamp,
+# is still newer than the token handed out
+SYNC_SAFETY_MARGIN = 60 * 1000000
+# the read-only methods a batch may call; those mapped to a tasklet run
+# concurrently, the others one after the other
+BATCH_METHODS = {
+    'getProfile': '_getProfileAsync',
+    'getConference': '_getConferenceAsync',
+    'queryConferences': '_queryConferencesAsync',
+    'getAnnouncement': '_getAnnouncementAsync',
+    'getConferencesCreated': None,
+    'getConferencesToAttend': None,
+    'getRecommendedConferences': None,
+    'getUpcomingConferences': None,
+    'getFeaturedSpeaker': None,
+    'getConferenceSessions': None,
 }
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS_SESSION = {
     "highlights": "Default",
@@ -82,13 +140,43 @@ FIELDS = {
     'TOPIC': 'topics',
     'MONTH': 'month',
     'MAX_ATTENDEES': 'maxAttendees',
+    'START_DATE': 'startDate',
+    'END_DATE': 'endDate',
 }
 
+# the property sets a projection query ordered by name may use; each needs
+# its composite index in index.yaml, so a mask is served by projecting the
+# smallest set covering it. Repeated properties can't be in them, since
+# projecting those returns one result per value.
+CONF_PROJECTIONS = [
+    frozenset(['name', 'city', 'maxAttendees', 'organizerUserId',
+               'seatsAvailable', 'startDate']),
+]
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
         message_types.VoidMessage,
         websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_UPCOMING_REQUEST = endpoints.ResourceContainer(
+        message_types.VoidMessage,
+        days=messages.IntegerField(1),
+)
+
+CONF_NEARBY_REQUEST = endpoints.ResourceContainer(
+        message_types.VoidMessage,
+        latitude=messages.FloatField(1),
+        longitude=messages.FloatField(2),
+        radiusKm=messages.FloatField(3),
+        limit=messages.IntegerField(4),
+)
+
+CONF_REGISTER_REQUEST = endpoints.ResourceContainer(
+        message_types.VoidMessage,
+        websafeConferenceKey=messages.StringField(1),
+        idempotencyKey=messages.StringField(2),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
         ConferenceForm,
         websafeConferenceKey=messages.StringField(1),
@@ -99,15 +187,23 @@ SESSION_POST_REQUEST = endpoints.ResourceContainer(
         websafeConferenceKey=messages.StringField(1),
 )
 
+SESSION_GET_REQUEST = endpoints.ResourceContainer(
+        message_types.VoidMessage,
+        websafeConferenceKey=messages.StringField(1),
+        fields=messages.StringField(2, repeated=True),
+)
+
 SESSION_BY_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
         message_types.VoidMessage,
         speaker=messages.StringField(1),
+        fields=messages.StringField(2, repeated=True),
 )
 
 SESSION_BY_TYPE_GET_REQUEST = endpoints.ResourceContainer(
         message_types.VoidMessage,
         websafeConferenceKey=messages.StringField(1),
         typeOfSession=messages.EnumField(TypeOfSession, 2),
+        fields=messages.StringField(3, repeated=True),
 )
 
 SESSION_WISHLIST_REQUEST = endpoints.ResourceContainer(
@@ -115,11 +211,25 @@ SESSION_WISHLIST_REQUEST = endpoints.ResourceContainer(
         websafeSessionKey=messages.StringField(1),
 )
 
+SESSION_SYNC_REQUEST = endpoints.ResourceContainer(
+        message_types.VoidMessage,
+        websafeConferenceKey=messages.StringField(1),
+        syncToken=messages.StringField(2),
+)
+
+SESSION_UPCOMING_REQUEST = endpoints.ResourceContainer(
+        message_types.VoidMessage,
+        hours=messages.IntegerField(1),
+        limit=messages.IntegerField(2),
+        fields=messages.StringField(3, repeated=True),
+)
+
 SESSION_DURATION_REQUEST = endpoints.ResourceContainer(
         message_types.VoidMessage,
         websafeConferenceKey=messages.StringField(1),
         minDuration=messages.IntegerField(2),
         maxDuration=messages.IntegerField(3),
+        fields=messages.StringField(4, repeated=True),
 )
 
 
@@ -137,22 +247,44 @@ class ConferenceApi(remote.Service):
 
     # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+    def _copyConferenceToForm(self, conf, displayName, fields=None):
+        """Copy relevant fields from Conference to ConferenceForm.
+
+        If a field mask is given only the fields in it are copied.
+        """
+        return conferenceForm(conf, displayName, fields)
+
+    @staticmethod
+    def _checkCoordinates(latitude, longitude):
+        """Reject a location unless it is complete and in range."""
+        if (latitude, longitude) != (None, None) and \
+                not geo.validCoordinates(latitude, longitude):
+            raise endpoints.BadRequestException(
+                    "'latitude' (-90 to 90) and 'longitude' (-180 to 180) "
+                    "must be given together")
+
+    @staticmethod
+    def _projectionFor(fields, projections):
+        """
+            Return the properties to project for a field mask, or None when
+            no indexed projection covers the mask.
+
+        :param fields: the field mask the client asked for
+        :param projections: the indexed property sets that may be projected
+        :return: sorted list of property names, or None
+        """
+        if not fields:
+            return None
+        # websafeKey comes from the key, which every projection returns
+        names = set(fields) - set(['websafeKey'])
+        if 'organizerDisplayName' in names:
+            names.remove('organizerDisplayName')
+            names.add('organizerUserId')
+        covering = [p for p in projections if names <= p]
+        if not names or not covering:
+            return None
+        # the extra properties are trimmed by _copyConferenceToForm
+        return sorted(min(covering, key=len))
 
     def _createConferenceObject(self, request):
         """
@@ -188,14 +320,13 @@ class ConferenceApi(remote.Service):
         # convert dates from strings to Date objects; set month based
         # on start_date
         if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10],
-                                                  "%Y-%m-%d").date()
+            data['startDate'] = parseDate(data['startDate'])
             data['month'] = data['startDate'].month
         else:
             data['month'] = 0
         if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10],
-                                                "%Y-%m-%d").date()
+            data['endDate'] = parseDate(data['endDate'])
+        self._checkCoordinates(data['latitude'], data['longitude'])
 
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
@@ -249,46 +380,89 @@ class ConferenceApi(remote.Service):
             if data not in (None, []):
                 # special handling for dates (convert string to Date)
                 if field.name in ('startDate', 'endDate'):
-                    data = datetime.strptime(data, "%Y-%m-%d").date()
+                    data = parseDate(data)
                     if field.name == 'startDate':
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        self._checkCoordinates(conf.latitude, conf.longitude)
         conf.put()
         prof = ndb.Key(Profile, user_id).get()
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
+    @instrumented
     def createConference(self, request):
         """Create new conference."""
-        return self._createConferenceObject(request)
+        form = self._createConferenceObject(request)
+        upcoming.invalidate()
+        return form
 
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='PUT', name='updateConference')
+    @instrumented
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        form = self._updateConferenceObject(request)
+        # only once the transaction has committed
+        cache.invalidateConference(request.websafeConferenceKey)
+        upcoming.invalidate()
+        return form
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
+    @instrumented
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                    'No conference found with key: %s' %
-                    request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        wsck = request.websafeConferenceKey
+
+        def load():
+            # get Conference object from request; bail if not found
+            conf = ndb.Key(urlsafe=wsck).get()
+            if not conf:
+                raise endpoints.NotFoundException(
+                        'No conference found with key: %s' % wsck)
+            prof = conf.key.parent().get()
+            return protojson.encode_message(
+                    self._copyConferenceToForm(conf,
+                                               getattr(prof, 'displayName')))
+
+        # return ConferenceForm, recomputed once per key on a cache miss
+        return protojson.decode_message(ConferenceForm, cache.getOrCompute(
+                cache.MEMCACHE_CONFERENCE_KEY % wsck, load,
+                cache.CONFERENCE_TTL))
+
+    @ndb.tasklet
+    def _getConferenceAsync(self, request):
+        """
+            Tasklet version of getConference() for batches: reads the same
+            cache entry, but loads a missing conference without taking the
+            recompute lock.
+        """
+        wsck = request.websafeConferenceKey
+        key = cache.MEMCACHE_CONFERENCE_KEY % wsck
+        encoded = cache.local.get(key)
+        if encoded is None:
+            envelope = yield ndb.get_context().memcache_get(key)
+            if envelope is not None:
+                encoded = envelope[0]
+        if encoded is None:
+            conf = yield ndb.Key(urlsafe=wsck).get_async()
+            if not conf:
+                raise endpoints.NotFoundException(
+                        'No conference found with key: %s' % wsck)
+            prof = yield conf.key.parent().get_async()
+            raise ndb.Return(self._copyConferenceToForm(
+                    conf, getattr(prof, 'displayName', None)))
+        raise ndb.Return(protojson.decode_message(ConferenceForm, encoded))
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST', name='getConferencesCreated')
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -322,6 +496,13 @@ class ConferenceApi(remote.Service):
         for filtr in filters:
             if filtr["field"] in ["month", "maxAttendees"]:
                 filtr["value"] = int(filtr["value"])
+            elif filtr["field"] in ["startDate", "endDate"]:
+                # DateProperty values are stored as datetimes
+                try:
+                    filtr["value"] = datetime.combine(
+                            parseDate(filtr["value"]), datetime.min.time())
+                except ValueError as e:
+                    raise endpoints.BadRequestException(str(e))
             formatted_query = ndb.query.FilterNode(filtr["field"],
                                                    filtr["operator"],
                                                    filtr["value"])
@@ -365,28 +546,45 @@ class ConferenceApi(remote.Service):
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
+    @instrumented
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
+        return self._queryConferencesAsync(request).get_result()
+
+    @ndb.tasklet
+    def _queryConferencesAsync(self, request):
+        """Tasklet running queryConferences()."""
+        fields = set(request.fields)
+        q = self._getQuery(request)
+
+        # a projection query only decodes the requested properties; it
+        # can't be combined with filters without an index per combination
+        projection = None
+        if not request.filters:
+            projection = self._projectionFor(fields, CONF_PROJECTIONS)
+        conferences = yield q.fetch_async(projection=projection)
 
         # need to fetch organiser displayName from profiles
         # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId))
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
         names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        if not fields or 'organizerDisplayName' in fields:
+            organisers = set(ndb.Key(Profile, conf.organizerUserId)
+                             for conf in conferences)
+            profiles = yield ndb.get_multi_async(list(organisers))
+
+            # put display names in a dict for easier fetching
+            for profile in profiles:
+                if profile:
+                    names[profile.key.id()] = profile.displayName
 
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
+        raise ndb.Return(ConferenceForms(
                 items=[self._copyConferenceToForm(
                         conf,
-                        names[conf.organizerUserId])
+                        names.get(conf.organizerUserId),
+                        fields)
                         for conf in conferences]
-        )
+        ))
 
     # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
@@ -454,45 +652,42 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
                       path='profile', http_method='GET', name='getProfile')
+    @instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
 
+    @ndb.tasklet
+    def _getProfileAsync(self, request):
+        """Tasklet version of getProfile() for batches."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        p_key = ndb.Key(Profile, getUserId(user))
+        prof = yield p_key.get_async()
+        if not prof:
+            prof = Profile(
+                    key=p_key,
+                    displayName=user.nickname(),
+                    mainEmail=user.email(),
+                    teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
+            )
+            yield prof.put_async()
+        raise ndb.Return(self._copyProfileToForm(prof))
+
     @endpoints.method(ProfileMiniForm, ProfileForm,
                       path='profile', http_method='POST', name='saveProfile')
+    @instrumented
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
     # - - - Conference Announcements - - - - - - - - - - - - - - - - - - - -
 
-    @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-                Conference.seatsAvailable <= 5,
-                Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
-
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
+    @instrumented
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
         return StringMessage(
@@ -500,43 +695,19 @@ class ConferenceApi(remote.Service):
                      ""
                )
 
-    # - - - Session Announcements - - - - - - - - - - - - - - - - - - - -
-
-    @staticmethod
-    def _setFeaturedSpeaker(speaker, wsck):
-        """
-            After creating a new session in a conference, the speaker is
-            checked. If there is more than one session by this speaker at this
-            conference, a Memcache entry is created/updated with the speaker
-            and session names.
-
-        Params:
-            - speaker: the speaker that was just added to the conference
-            - wsck: the websafeConferenceKey representing a URL safe id for the
-                    conference the speaker is speaking at
-        Returns: nothing
-        """
-        conf = ndb.Key(urlsafe=wsck).get()
-        sessions = Session.query(ancestor=conf.key)
-        sessions_by_speaker = sessions.filter(
-                Session.speaker == speaker
-        ).fetch(
-                projection=[Session.name]
-        )
+    @ndb.tasklet
+    def _getAnnouncementAsync(self, request):
+        """Tasklet version of getAnnouncement() for batches."""
+        announcement = yield ndb.get_context().memcache_get(
+                MEMCACHE_ANNOUNCEMENTS_KEY)
+        raise ndb.Return(StringMessage(data=announcement or ""))
 
-        if len(sessions_by_speaker) > 1:
-            text_base = ('Featured Speaker {0} Speaking at '
-                         'the following sessions: {1}, at the {2} conference')
-            announcement = text_base.format(
-                    speaker,
-                    ', '.join(session.name for session in sessions_by_speaker),
-                    conf.name)
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, announcement)
-        # Otherwise, leave the featured speaker as is.
+    # - - - Session Announcements - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='speaker/featured',
                       http_method='GET', name='getFeaturedSpeaker')
+    @instrumented
     def getFeaturedSpeaker(self, request):
         """
             Checks memcache for the Featured Speaker Key.
@@ -550,6 +721,17 @@ class ConferenceApi(remote.Service):
 
     # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
+    def _registerAndInvalidate(self, request, reg=True):
+        """Register or unregister user, then drop the cached conference
+        and push the new seat count to the pages showing it."""
+        retval = self._conferenceRegistration(request, reg)
+        # seatsAvailable changed; only invalidate once the transaction has
+        # committed, so no reader can cache the old count again
+        cache.invalidateConference(request.websafeConferenceKey)
+        if retval.data:
+            seatpush.publish(request.websafeConferenceKey)
+        return retval
+
     @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
@@ -571,10 +753,11 @@ class ConferenceApi(remote.Service):
                 raise ConflictException(
                         "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            # check if seats avail; freed seats are held for the waitlist
+            if conf.seatsAvailable - (conf.heldSeats or 0) <= 0:
                 raise ConflictException(
-                        "There are no seats available.")
+                        "There are no seats available. Join the waitlist "
+                        "to be registered when a seat frees up.")
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
@@ -586,9 +769,12 @@ class ConferenceApi(remote.Service):
             # check if user already registered
             if wsck in prof.conferenceKeysToAttend:
 
-                # unregister user, add back one seat
+                # unregister user, add back one seat and hold it for the
+                # waitlist, which takes it once this transaction commits
                 prof.conferenceKeysToAttend.remove(wsck)
                 conf.seatsAvailable += 1
+                conf.heldSeats = (conf.heldSeats or 0) + 1
+                waitlist.enqueuePromotion(wsck, transactional=True)
                 retval = True
             else:
                 retval = False
@@ -598,9 +784,93 @@ class ConferenceApi(remote.Service):
         conf.put()
         return BooleanMessage(data=retval)
 
+    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+                      path='conferences/recommended',
+                      http_method='GET', name='getRecommendedConferences')
+    @instrumented
+    def getRecommendedConferences(self, request):
+        """
+            Get the conferences recommended to the user from the topics and
+            attendees of the ones they registered for. The lists are
+            precomputed by a cron job, so this is a single cache read.
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return getRecommended(getUserId(user))
+
+    @endpoints.method(CONF_UPCOMING_REQUEST, ConferenceForms,
+                      path='conferences/upcoming',
+                      http_method='GET', name='getUpcomingConferences')
+    @instrumented
+    def getUpcomingConferences(self, request):
+        """
+            Get the conferences that have not started yet, soonest first,
+            from the list a cron job keeps in cache.
+
+        :param request object containing
+                - days: optional, only the conferences starting within this
+                        many days
+        :return: ConferenceForms
+        """
+        if request.days is not None and request.days < 0:
+            raise endpoints.BadRequestException('days must not be negative')
+        return upcoming.getUpcoming(request.days)
+
+    @endpoints.method(CONF_NEARBY_REQUEST, ConferenceForms,
+                      path='conferences/nearby',
+                      http_method='GET', name='searchConferencesNearby')
+    @instrumented
+    def searchConferencesNearby(self, request):
+        """
+            Get the conferences within a radius of a point, nearest first.
+            The geohash cells covering the circle are scanned concurrently
+            and the conferences in them filtered by distance.
+
+        :param request object containing
+                - latitude, longitude: the centre of the search
+                - radiusKm: the radius, 25km by default
+                - limit: the maximum number of conferences, 20 by default
+        :return: ConferenceForms
+        """
+        if not geo.validCoordinates(request.latitude, request.longitude):
+            raise endpoints.BadRequestException(
+                    "'latitude' (-90 to 90) and 'longitude' (-180 to 180) "
+                    "are required")
+        radius = request.radiusKm or 25.0
+        if not 0 < radius <= NEARBY_MAX_RADIUS_KM:
+            raise endpoints.BadRequestException(
+                    "'radiusKm' must be between 0 and %d" %
+                    NEARBY_MAX_RADIUS_KM)
+        limit = min(request.limit or 20, NEARBY_MAX_RESULTS)
+
+        futures = [Conference.query(Conference.geohashes == cell).fetch_async()
+                   for cell in geo.coveringCells(request.latitude,
+                                                 request.longitude, radius)]
+        nearby = []
+        for future in futures:
+            for conf in future.get_result():
+                distance = geo.distanceKm(request.latitude, request.longitude,
+                                          conf.latitude, conf.longitude)
+                if distance <= radius:
+                    nearby.append((distance, conf))
+        nearby.sort(key=lambda pair: pair[0])
+        conferences = [conf for distance, conf in nearby[:limit]]
+
+        organisers = set(ndb.Key(Profile, conf.organizerUserId)
+                         for conf in conferences)
+        names = dict((prof.key.id(), prof.displayName)
+                     for prof in ndb.get_multi(list(organisers)) if prof)
+        return ConferenceForms(
+                items=[self._copyConferenceToForm(
+                        conf, names.get(conf.organizerUserId))
+                       for conf in conferences]
+        )
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
+    @instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser()  # get user Profile
@@ -625,23 +895,156 @@ class ConferenceApi(remote.Service):
                                                   for conf in conferences]
         )
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+    def _idempotent(self, request, name, func, response_type):
+        """
+            Run func(request) at most once per user, conference and
+            client-supplied idempotencyKey, replaying the stored result to
+            retries. A key reused for another conference is a new request.
+
+            A pending marker is added to memcache before running, so
+            concurrent retries of the same request don't all open a
+            transaction: they wait up to IDEMPOTENCY_WAIT for the first run
+            to store its result and replay it, and are only turned away if
+            it is still running then. Failed requests drop the marker, so
+            they can be retried.
+
+        :param request: request with an optional idempotencyKey field
+        :param name: name of the operation, part of the cache key
+        :param func: callable doing the actual work
+        :param response_type: the Message class func returns
+        :return: the result of func, or of its first run for a retry
+        """
+        if not request.idempotencyKey:
+            return func(request)
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        cache_key = MEMCACHE_IDEMPOTENCY_KEY % (
+                name, getUserId(user), request.websafeConferenceKey,
+                request.idempotencyKey)
+        deadline = time.time() + IDEMPOTENCY_WAIT
+        while not memcache.add(cache_key, IDEMPOTENCY_PENDING,
+                               time=IDEMPOTENCY_TTL):
+            cached = memcache.get(cache_key)
+            if cached is None:
+                # evicted or failed in between; just run the request
+                break
+            if cached != IDEMPOTENCY_PENDING:
+                return protojson.decode_message(response_type, cached)
+            if time.time() >= deadline:
+                raise ConflictException(
+                        "This request is already being processed")
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+        try:
+            result = func(request)
+        except Exception:
+            memcache.delete(cache_key)
+            raise
+        memcache.set(cache_key, protojson.encode_message(result),
+                     time=IDEMPOTENCY_TTL)
+        return result
+
+    @endpoints.method(CONF_REGISTER_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @instrumented
     def registerForConference(self, request):
-        """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        """Register user for selected conference.
 
-    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+        Retries carrying the same idempotencyKey get the original result.
+        """
+        return self._idempotent(request, 'register',
+                                self._registerAndInvalidate, BooleanMessage)
+
+    @endpoints.method(CONF_REGISTER_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
+    @instrumented
     def unregisterFromConference(self, request):
-        """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        """Unregister user for selected conference.
+
+        Retries carrying the same idempotencyKey get the original result.
+        """
+        return self._idempotent(
+                request, 'unregister',
+                lambda r: self._registerAndInvalidate(r, reg=False),
+                BooleanMessage)
+
+    def _waitlistForm(self, wsck, entry):
+        """Return the WaitlistForm of a user's waitlist entry."""
+        if entry:
+            return WaitlistForm(websafeConferenceKey=wsck,
+                                position=waitlist.position(entry),
+                                registered=False)
+        prof = self._getProfileFromUser()
+        return WaitlistForm(
+                websafeConferenceKey=wsck,
+                registered=wsck in prof.conferenceKeysToAttend)
+
+    @endpoints.method(CONF_GET_REQUEST, WaitlistForm,
+                      path='conference/{websafeConferenceKey}/waitlist',
+                      http_method='POST', name='joinConferenceWaitlist')
+    @instrumented
+    def joinConferenceWaitlist(self, request):
+        """Queue user for a seat at a full conference.
+
+        Waitlisted users are registered in order by a task as seats free up,
+        so there is no need to keep retrying registerForConference.
+        """
+        prof = self._getProfileFromUser()
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+        if wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                    "You have already registered for this conference")
+
+        key = waitlist.entryKey(prof.key.id(), wsck)
+        entry = key.get()
+        if not entry:
+            entry = WaitlistEntry(key=key, conference=wsck)
+            entry.put()
+        if conf.seatsAvailable > 0:
+            # a seat is free (or just freed up); let the worker fill it
+            waitlist.enqueuePromotion(wsck)
+        return self._waitlistForm(wsck, entry)
+
+    @endpoints.method(CONF_GET_REQUEST, WaitlistForm,
+                      path='conference/{websafeConferenceKey}/waitlist',
+                      http_method='GET', name='getConferenceWaitlistPosition')
+    @instrumented
+    def getConferenceWaitlistPosition(self, request):
+        """Return user's waitlist position, or whether they got a seat."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        wsck = request.websafeConferenceKey
+        entry = waitlist.entryKey(getUserId(user), wsck).get()
+        return self._waitlistForm(wsck, entry)
+
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+                      path='conference/{websafeConferenceKey}/waitlist',
+                      http_method='DELETE', name='leaveConferenceWaitlist')
+    @instrumented
+    def leaveConferenceWaitlist(self, request):
+        """Remove user from a conference's waitlist."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        key = waitlist.entryKey(getUserId(user), request.websafeConferenceKey)
+        if not key.get():
+            return BooleanMessage(data=False)
+        key.delete()
+        return BooleanMessage(data=True)
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='filterPlayground',
                       http_method='GET', name='filterPlayground')
+    @instrumented
     def filterPlayground(self, request):
         """Filter Playground"""
         q = Conference.query()
@@ -660,17 +1063,20 @@ class ConferenceApi(remote.Service):
 
     # Sessions  - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def _copySessionToForm(self, session):
+    def _copySessionToForm(self, session, fields=None):
         """
             Helper function that copies data from the session object to a
             SessionForm for output
 
         :param session: object presenting the Conference Session to be copied
+        :param fields: optional field mask; only these fields are copied
         :return: SessionForm - an object in the format of the SessionForm model
         """
         """Copy relevant fields from Conference to ConferenceForm."""
         sf = SessionForm()
         for field in sf.all_fields():
+            if fields and field.name not in fields:
+                continue
             if hasattr(session, field.name):
                 # convert Date to date string; just copy others
                 if field.name == 'date':
@@ -742,8 +1148,7 @@ class ConferenceApi(remote.Service):
         # convert dates from strings to Date objects; set month based on
         # start_date
         if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10],
-                                             "%Y-%m-%d").date()
+            data['date'] = parseDate(data['date'])
 
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
@@ -752,9 +1157,11 @@ class ConferenceApi(remote.Service):
         data['key'] = s_key
         data['conference_id'] = request.conference_id = conf_id
 
-        # create Session, add task to see if the featured speaker
-        # needs to be updated and then return the Session in a SessionForm
+        # create Session, refresh the conference's schedule snapshot, add
+        # task to see if the featured speaker needs to be updated and then
+        # return the Session in a SessionForm
         Session(**data).put()
+        rebuildSchedule(conf.key)
         taskqueue.add(params={'speaker': data['speaker'],
                               'wsck': request.websafeConferenceKey},
                       url='/tasks/set_featured_speaker'
@@ -770,8 +1177,9 @@ class ConferenceApi(remote.Service):
                         session to add to the user's wishlist
         :param do_add: boolean representing if the session should be added
                        or removed from the user's wishlist
-        :return: boolean representing if the request work was formed
-                 successfully
+        :return: WishlistForm with a boolean representing if the request work
+                 was formed successfully and, when adding, the wishlisted
+                 sessions that overlap with the new one
         """
 
         # check if the session exists, given websafeKey
@@ -781,31 +1189,50 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                     'No session found with key: %s' % wssk)
 
-        retval = None
         prof = self._getProfileFromUser()  # get user Profile
+        # check if user already added it otherwise add
+        if do_add and wssk in prof.sessionKeysInWishlist:
+            raise ConflictException(
+                    "You have already added this session to your wishlist")
+        retval, conflicts = self._applyWishlistOp(prof, session, do_add)
+
+        # write updates back to the datastore & return
+        prof.put()
+        return WishlistForm(data=retval, conflictingSessionKeys=conflicts)
+
+    def _applyWishlistOp(self, prof, session, do_add):
+        """
+            Helper function that adds/removes a session to/from the wishlist
+            of a Profile, without writing it
+
+        :param prof: the user's Profile, updated in place
+        :param session: the Session to add or remove
+        :param do_add: boolean representing if the session should be added
+                       or removed from the user's wishlist
+        :return: tuple of a boolean representing if the wishlist changed and
+                 the websafe keys of the wishlisted sessions overlapping the
+                 added one
+        """
+        wssk = session.key.urlsafe()
+        schedule = wishlist.ensureSchedule(prof)
         if do_add:  # add to wishlist
-            # check if user already registered otherwise add
             if wssk in prof.sessionKeysInWishlist:
-                raise ConflictException(
-                        "You have already added this session to your wishlist")
+                return False, []
             prof.sessionKeysInWishlist.append(wssk)
-            retval = True
-        else:  # remove from wishlist
-            # check if user already registered, and removes the user
-            if wssk in prof.sessionKeysInWishlist:
-                prof.sessionKeysInWishlist.remove(wssk)
-                retval = True
-            else:
-                retval = False
+            return True, wishlist.addSession(schedule, session)
 
-        # write updates back to the datastore & return
-        prof.put()
-        return BooleanMessage(data=retval)
+        # remove from wishlist
+        if wssk in prof.sessionKeysInWishlist:
+            prof.sessionKeysInWishlist.remove(wssk)
+            wishlist.removeSession(schedule, session)
+            return True, []
+        return False, []
 
     # CONF-specific session queries
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
                       path='conference/{websafeConferenceKey}/session',
                       http_method='POST', name='createSession')
+    @instrumented
     def createSession(self, request):
         """
             Public facing endpoint used for a user to create a new
@@ -820,9 +1247,10 @@ class ConferenceApi(remote.Service):
         """
         return self._createSessionObject(request)
 
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSION_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/session',
                       http_method='GET', name='getConferenceSessions')
+    @instrumented
     def getConferenceSessions(self, request):
         """
             Public facing endpoint that gets all the sessions in the datastore
@@ -831,6 +1259,8 @@ class ConferenceApi(remote.Service):
         :param request object containing
                 - websafeConferenceKey: the websafeKey of the Conference to get
                                         the sessions for
+                - fields: optional field mask of the SessionForm fields to
+                          return
         :return: list of SessionForm objects representing the sessions that fit
                  the query
         """
@@ -843,15 +1273,75 @@ class ConferenceApi(remote.Service):
                     request.websafeConferenceKey
             )
 
-        # get the sessions for this conference and return them
-        sessions = Session.query(ancestor=conf.key).fetch()
+        # get the sessions for this conference from its schedule snapshot
+        fields = set(request.fields)
+        sessions = getSchedule(conf.key).sessions()
         return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessions]
+                items=[self._copySessionToForm(session, fields)
+                       for session in sessions]
+        )
+
+    @endpoints.method(SESSION_SYNC_REQUEST, SessionSyncForm,
+                      path='conference/{websafeConferenceKey}/session/sync',
+                      http_method='GET', name='syncConferenceSessions')
+    @instrumented
+    def syncConferenceSessions(self, request):
+        """
+            Public facing endpoint that returns only the sessions of a
+            conference that were created, changed or deleted since the
+            given sync token.
+
+        :param request object containing
+                - websafeConferenceKey: the websafeKey of the Conference to get
+                                        the session changes for
+                - syncToken: the token returned by the previous sync; leave
+                             empty to get every session
+        :return: SessionSyncForm with the changed sessions, the websafe keys
+                 of the deleted sessions and the token for the next sync
+        """
+        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                    'No conference found with key: %s' %
+                    request.websafeConferenceKey
+            )
+        try:
+            since = int(request.syncToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid 'syncToken'")
+
+        now = syncTimestamp()
+        if since < oldestSyncToken(now):
+            # the tombstones of deletes that old may be pruned already
+            since = 0
+
+        # ancestor queries are strongly consistent, but the stamps come from
+        # the clocks of the instances that wrote them
+        sessions = Session.query(ancestor=conf.key)
+        tombstones = SessionTombstone.query(ancestor=conf.key)
+        if since:
+            sessions = sessions.filter(Session.modified > since)
+            tombstones = tombstones.filter(SessionTombstone.modified > since)
+        sessions_future = sessions.fetch_async()
+        tombstones = tombstones.fetch() if since else []
+        sessions = sessions_future.get_result()
+
+        # everything stamped up to SYNC_SAFETY_MARGIN ago has been seen now,
+        # changed or not; later stamps are sent again on the next sync
+        # rather than possibly missed
+        token = max(since, now - SYNC_SAFETY_MARGIN)
+        return SessionSyncForm(
+                items=[self._copySessionToForm(session)
+                       for session in sessions],
+                deletedKeys=[t.websafeKey for t in tombstones],
+                syncToken=str(token),
+                fullSync=not since
         )
 
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/session/schedule',
                       http_method='GET', name='getConferenceSessionsSchedule')
+    @instrumented
     def getConferenceSessionSchedule(self, request):
         """
             Public facing endpoint for a user to get their "schedule" for a
@@ -866,29 +1356,17 @@ class ConferenceApi(remote.Service):
         """
         # get user and their sessions
         prof = self._getProfileFromUser()  # get user Profile
-        session_keys = [ndb.Key(urlsafe=wssk)
-                        for wssk in prof.sessionKeysInWishlist]
-        wishlist_sessions = ndb.get_multi(session_keys)
 
-        # get conference and sessions in that conference
-        # make sure it's ordered by date and start time.
+        # get conference; its schedule snapshot is already ordered by date
+        # and start time, so just keep the sessions on the user's wishlist
         conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
         if not conf:
             raise endpoints.NotFoundException(
                     'No conference found with key: %s' %
                     request.websafeConferenceKey
             )
-        q = Session.query(ancestor=conf.key)
-        q = q.order(Session.date)
-        conf_sessions = q.order(Session.start_time).fetch()
-
-        # throw out all the sessions that aren't on the user's wishlist
-        # I'd love to do a JOIN here, but datastore doesn't support it.
-        session_list = []
-        for cs in conf_sessions:
-            for ws in wishlist_sessions:
-                if ws.key.urlsafe() == cs.key.urlsafe():
-                    session_list.append(ws)
+        session_list = getSchedule(conf.key).withKeys(
+                prof.sessionKeysInWishlist)
 
         return SessionForms(
                 items=[self._copySessionToForm(session)
@@ -898,6 +1376,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_DURATION_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/session/duration',
                       http_method='POST', name='getConferenceSessionsByDuration')
+    @instrumented
     def getConferenceSessionsByDuration(self, request):
         """
             Public facing endpoint for a user to get all the sessions that fit
@@ -910,6 +1389,8 @@ class ConferenceApi(remote.Service):
                                a session the user is looking for
                 - maxDuration: an integer representing the maximum duration of
                                a session the user is looking for
+                - fields: optional field mask of the SessionForm fields to
+                          return
         :return: list of SessionForm objects representing the sessions that fit
                  the query
         """
@@ -919,18 +1400,18 @@ class ConferenceApi(remote.Service):
                     'No conference found with key: %s' %
                     request.websafeConferenceKey
             )
-        q = Session.query(ancestor=conf.key)
-        q = q.order(Session.duration)
-        q = q.filter(Session.duration >= request.minDuration)
-        sessions = q.filter(Session.duration <= request.maxDuration).fetch()
+        sessions = getSchedule(conf.key).withDuration(request.minDuration,
+                                                      request.maxDuration)
 
-        return SessionForms(items=[self._copySessionToForm(session)
+        fields = set(request.fields)
+        return SessionForms(items=[self._copySessionToForm(session, fields)
                                    for session in sessions]
                             )
 
     @endpoints.method(SESSION_BY_TYPE_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/session/type/{typeOfSession}',
                       http_method='GET', name='getConferenceSessionsByType')
+    @instrumented
     def getConferenceSessionsByType(self, request):
         """
             Public facing endpoint that gets sessions based on the type for
@@ -940,6 +1421,8 @@ class ConferenceApi(remote.Service):
                 - websafeConferenceKey: the websafeKey of the Conference to
                                         filter to
                 - typeOfSession: the session that the user wants to filter to
+                - fields: optional field mask of the SessionForm fields to
+                          return
         :return: list of SessionForm objects representing the sessions that fit
                  the query
         """
@@ -949,19 +1432,164 @@ class ConferenceApi(remote.Service):
                     'No conference found with key: %s' %
                     request.websafeConferenceKey
             )
-        q = Session.query(ancestor=conf.key)
-        sessions = q.filter(
-                Session.type_of_session == str(request.typeOfSession)
-        ).fetch()
+        sessions = getSchedule(conf.key).ofType(str(request.typeOfSession))
 
+        fields = set(request.fields)
         return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessions]
+                items=[self._copySessionToForm(session, fields)
+                       for session in sessions]
         )
 
+    def _searchSessions(self, startAfter=None, startBefore=None,
+                        includeTypes=(), excludeTypes=(), minDuration=None,
+                        maxDuration=None, startDate=None, endDate=None):
+        """
+            Helper function that finds the sessions, across all conferences,
+            matching any combination of the given criteria.
+
+            Every session is indexed under a type_hour bucket (type x start
+            hour), so the start time window is one range scan per session
+            type that isn't excluded. The scans run in parallel and only the
+            remaining criteria are checked in memory, on the matching
+            sessions alone.
+
+        :param startAfter: HHMM the sessions start at or after
+        :param startBefore: HHMM the sessions start before
+        :param includeTypes: session type names to keep, all when empty
+        :param excludeTypes: session type names to leave out
+        :param minDuration: minimum duration in minutes
+        :param maxDuration: maximum duration in minutes
+        :param startDate: first date (datetime.date) the sessions are on
+        :param endDate: last date (datetime.date) the sessions are on
+        :return: list of Session objects ordered by starts_at
+        """
+        types = [t.name for t in TypeOfSession]
+        if includeTypes:
+            types = [t for t in types if t in includeTypes]
+        types = [t for t in types if t not in excludeTypes]
+
+        first_hour = (startAfter or 0) // 100
+        last_hour = 99
+        if startBefore is not None:
+            if startBefore <= 0:
+                return []
+            last_hour = (startBefore - 1) // 100
+
+        futures = [Session.query(
+                Session.type_hour >= typeHourBucket(t, first_hour * 100),
+                Session.type_hour <= typeHourBucket(t, last_hour * 100)
+        ).fetch_async() for t in types]
+
+        sessions = []
+        for future in futures:
+            for session in future.get_result():
+                start_time = session.start_time or 0
+                if startAfter is not None and start_time < startAfter:
+                    continue
+                if startBefore is not None and start_time >= startBefore:
+                    continue
+                if minDuration is not None and \
+                        (session.duration or 0) < minDuration:
+                    continue
+                if maxDuration is not None and \
+                        (session.duration or 0) > maxDuration:
+                    continue
+                if startDate and (not session.date or
+                                  session.date < startDate):
+                    continue
+                if endDate and (not session.date or session.date > endDate):
+                    continue
+                sessions.append(session)
+
+        sessions.sort(key=lambda s: s.starts_at or datetime.min)
+        return sessions
+
+    @endpoints.method(SessionSearchForm, SessionForms,
+                      path='session/search',
+                      http_method='POST', name='searchSessions')
+    @instrumented
+    def searchSessions(self, request):
+        """
+            Public facing endpoint that searches the sessions of all
+            conferences by start time window, session types, duration range
+            and date range, in any combination.
+
+        :param request object containing
+                - startAfter/startBefore: HHMM start time window
+                - includeTypes/excludeTypes: session types to keep or leave
+                                             out
+                - minDuration/maxDuration: duration range in minutes
+                - startDate/endDate: YYYY-MM-DD date range, inclusive
+                - fields: optional field mask of the SessionForm fields to
+                          return
+        :return: list of SessionForm objects representing the sessions that fit
+                 the query
+        """
+        dates = {}
+        for field in ('startDate', 'endDate'):
+            value = getattr(request, field)
+            if value:
+                try:
+                    dates[field] = parseDate(value)
+                except ValueError:
+                    raise endpoints.BadRequestException(
+                            "'%s' must be formatted as YYYY-MM-DD" % field)
+
+        sessions = self._searchSessions(
+                startAfter=request.startAfter,
+                startBefore=request.startBefore,
+                includeTypes=[str(t) for t in request.includeTypes],
+                excludeTypes=[str(t) for t in request.excludeTypes],
+                minDuration=request.minDuration,
+                maxDuration=request.maxDuration,
+                **dates)
+
+        fields = set(request.fields)
+        return SessionForms(items=[self._copySessionToForm(session, fields)
+                                   for session in sessions]
+                            )
+
+    @endpoints.method(SESSION_UPCOMING_REQUEST, SessionForms,
+                      path='session/upcoming',
+                      http_method='GET', name='getUpcomingSessions')
+    @instrumented
+    def getUpcomingSessions(self, request):
+        """
+            Public facing endpoint listing the sessions, across all
+            conferences, that start within the next few hours, in start
+            order. Sessions carry no time zone, so "now" is server (UTC)
+            time.
+
+        :param request object containing
+                - hours: the length of the window, 2 by default
+                - limit: the maximum number of sessions, 100 by default
+                - fields: optional field mask of the SessionForm fields to
+                          return
+        :return: list of SessionForm objects starting within the window
+        """
+        hours = request.hours or 2
+        if not 0 < hours <= UPCOMING_MAX_HOURS:
+            raise endpoints.BadRequestException(
+                    "'hours' must be between 1 and %d" % UPCOMING_MAX_HOURS)
+        limit = min(request.limit or 100, UPCOMING_MAX_SESSIONS)
+
+        # a single range scan over the starts_at index
+        now = datetime.now()
+        sessions = Session.query(
+                Session.starts_at >= now,
+                Session.starts_at < now + timedelta(hours=hours)
+        ).order(Session.starts_at).fetch(limit)
+
+        fields = set(request.fields)
+        return SessionForms(items=[self._copySessionToForm(session, fields)
+                                   for session in sessions]
+                            )
+
     # SESSION Query
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='session/noWorkshopsBefore7pm',
                       http_method='GET', name='getSessionsNotWorkshopsBefore7pm')
+    @instrumented
     def getSessionsNotWorkshopsBefore7pm(self, request):
         """
             Public facing endpoint that filters the sessions to those that are
@@ -971,17 +1599,20 @@ class ConferenceApi(remote.Service):
         :return: list of SessionForm objects representing the sessions that fit
                  the query
         """
-        # perform the inequality filter for sessions starting before 7pm
-        q = Session.query()
-        q = q.order(Session.start_time)
-        sessions = q.filter(Session.start_time < 1900).fetch()
-
-        # perform the next "inequality filter" with is an O(n) loop,
-        # discarding the sessions that are "workshops"
-        response = []
-        for session in sessions:
-            if session.type_of_session != str(TypeOfSession.WORKSHOP):
-                response.append(session)
+        if mapper.backfillDone('session_indexes'):
+            # the type_hour index turns both "inequalities" into one range
+            # scan per remaining session type
+            response = self._searchSessions(
+                    startBefore=1900,
+                    excludeTypes=[str(TypeOfSession.WORKSHOP)])
+        else:
+            # sessions stored before type_hour existed only have it once
+            # the session_indexes mapper has rewritten them
+            sessions = Session.query(Session.start_time < 1900).order(
+                    Session.start_time).fetch()
+            response = [session for session in sessions
+                        if session.type_of_session !=
+                        str(TypeOfSession.WORKSHOP)]
 
         return SessionForms(items=[self._copySessionToForm(session)
                                    for session in response]
@@ -990,6 +1621,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_BY_SPEAKER_GET_REQUEST, SessionForms,
                       path='session/speaker/{speaker}',
                       http_method='GET', name='getSessionsBySpeaker')
+    @instrumented
     def getSessionsBySpeaker(self, request):
         """
             Public facing endpoint that gets all the sessions in the datastore
@@ -997,19 +1629,24 @@ class ConferenceApi(remote.Service):
 
         :param request object containing
                 - speaker: the string representing the speaker
+                - fields: optional field mask of the SessionForm fields to
+                          return
         :return: list of SessionForm objects representing the sessions that fit
                     the query
         """
 
         sessions = Session.query(Session.speaker == request.speaker).fetch()
+        fields = set(request.fields)
         return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessions]
+                items=[self._copySessionToForm(session, fields)
+                       for session in sessions]
         )
 
     # SESSION WISHLIST endpoints
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='session/wishlist',
                       http_method='GET', name='getSessionsInWishlist')
+    @instrumented
     def getSessionsInWishlist(self, request):
         """
             Public facing endpoint used for a user to see what sessions are in
@@ -1029,9 +1666,82 @@ class ConferenceApi(remote.Service):
                        for session in sessions]
         )
 
-    @endpoints.method(SESSION_WISHLIST_REQUEST, BooleanMessage,
+    @endpoints.method(message_types.VoidMessage, SessionConflictForms,
+                      path='session/wishlist/conflicts',
+                      http_method='GET', name='getWishlistConflicts')
+    @instrumented
+    def getWishlistConflicts(self, request):
+        """
+            Public facing endpoint that returns every pair of overlapping
+            sessions in the user's wishlist, from the wishlist schedule kept
+            on the profile rather than by loading the sessions.
+
+        :param request object which is Void
+        :return: list of SessionConflictForm objects, one per overlapping
+                 pair of sessions
+        """
+        prof = self._getProfileFromUser()
+        if prof.wishlistSchedule is None:
+            wishlist.ensureSchedule(prof)
+            prof.put()
+        return SessionConflictForms(
+                items=[SessionConflictForm(websafeSessionKey=first,
+                                           conflictingSessionKey=second)
+                       for first, second in
+                       wishlist.allConflicts(prof.wishlistSchedule)]
+        )
+
+    @endpoints.method(WishlistOpForms, WishlistForms,
+                      path='session/wishlist/batch',
+                      http_method='POST', name='updateWishlist')
+    @instrumented
+    def updateWishlist(self, request):
+        """
+            Public facing endpoint that applies several wishlist additions
+            and removals at once, with a single Profile write.
+
+        :param request object containing
+                - ops: list of WishlistOpForm, each a websafeSessionKey and
+                       whether to add (the default) or remove it, applied in
+                       order; at most MAX_BATCH
+        :return: list of WishlistForm objects, one per op; data is False for
+                 unknown sessions and for ops that changed nothing
+        """
+        if len(request.ops) > MAX_BATCH:
+            raise endpoints.BadRequestException(
+                    'At most %d ops per call' % MAX_BATCH)
+        keys = []
+        for op in request.ops:
+            try:
+                key = ndb.Key(urlsafe=op.websafeSessionKey)
+            except (TypeError, ProtocolBufferDecodeError):
+                key = None
+            keys.append(key if key and key.kind() == 'Session' else None)
+        # look every session up in one batch
+        found = ndb.get_multi([k for k in keys if k])
+        sessions = dict((session.key, session) for session in found
+                        if session)
+
+        prof = self._getProfileFromUser()
+        results = []
+        for op, key in zip(request.ops, keys):
+            session = sessions.get(key)
+            retval, conflicts = False, []
+            if session:
+                retval, conflicts = self._applyWishlistOp(prof, session,
+                                                          op.add)
+            results.append(WishlistForm(
+                    websafeSessionKey=op.websafeSessionKey, data=retval,
+                    conflictingSessionKeys=conflicts))
+
+        if any(result.data for result in results):
+            prof.put()
+        return WishlistForms(items=results)
+
+    @endpoints.method(SESSION_WISHLIST_REQUEST, WishlistForm,
                       path='session/{websafeSessionKey}',
                       http_method='POST', name='addSessionToWishlist')
+    @instrumented
     def addSessionToWishlist(self, request):
         """
             Public facing endpoint that a user calls when they want to add a
@@ -1044,9 +1754,10 @@ class ConferenceApi(remote.Service):
         """
         return self._sessionWishlist(request)
 
-    @endpoints.method(SESSION_WISHLIST_REQUEST, BooleanMessage,
+    @endpoints.method(SESSION_WISHLIST_REQUEST, WishlistForm,
                       path='session/{websafeSessionKey}',
                       http_method='DELETE', name='removeSessionFromWishlist')
+    @instrumented
     def removeSessionFromWishlist(self, request):
         """
             Public facing endpoint that a user calls when they want to remove a
@@ -1059,4 +1770,61 @@ class ConferenceApi(remote.Service):
         """
         return self._sessionWishlist(request, False)
 
+    # - - - Batch - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @ndb.tasklet
+    def _batchCallAsync(self, call):
+        """Run one call of a batch; errors are returned, not raised."""
+        response = BatchResponseForm(id=call.id, method=call.method)
+        try:
+            if call.method not in BATCH_METHODS:
+                raise endpoints.BadRequestException(
+                        '%s can not be called in a batch' % call.method)
+            method = getattr(self, call.method)
+            try:
+                request = protojson.decode_message(
+                        method.remote.request_type, call.params or '{}')
+            except (messages.Error, ValueError) as e:
+                raise endpoints.BadRequestException(
+                        'Invalid params for %s: %s' % (call.method, e))
+            tasklet = BATCH_METHODS[call.method]
+            if tasklet:
+                result = yield getattr(self, tasklet)(request)
+            else:
+                result = method(request)
+            response.result = protojson.encode_message(result)
+        except endpoints.ServiceException as e:
+            response.error = str(e)
+            response.code = e.http_status
+        raise ndb.Return(response)
+
+    @endpoints.method(BatchRequestForms, BatchResponseForms,
+                      path='batch', http_method='POST', name='batch')
+    @instrumented
+    def batch(self, request):
+        """
+            Run several read-only API calls in one round trip. Calls with a
+            tasklet version run concurrently; every call gets its own result
+            or error, in request order.
+
+        :param request object containing
+                - requests: the calls, each with an id echoed back, the
+                            method name and its JSON encoded params
+        :return: BatchResponseForms with one response per call
+        """
+        if len(request.requests) > MAX_BATCH:
+            raise endpoints.BadRequestException(
+                    'At most %d calls per batch' % MAX_BATCH)
+        # start the concurrent calls first, so their RPCs are in flight
+        # while the others run
+        order = sorted(range(len(request.requests)),
+                       key=lambda i: not BATCH_METHODS.get(
+                               request.requests[i].method))
+        futures = {}
+        for i in order:
+            futures[i] = self._batchCallAsync(request.requests[i])
+        return BatchResponseForms(
+                responses=[futures[i].get_result()
+                           for i in range(len(request.requests))])
+
 api = endpoints.api_server([ConferenceApi])  # register API
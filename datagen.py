@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""
+datagen.py -- deterministic synthetic Conference/Session/Profile datasets
+
+Builds large, realistically skewed datasets with the real models.py classes:
+Zipf-distributed cities, topics and speakers, a few hot conferences with
+thousands of registrants and users with long wishlists. The same seed always
+produces the same entities (keys included), so benchmark runs on different
+code are comparable. The explicit ids are reserved with allocate_ids, then
+the entities are written with put_multi_async in parallel batches; the
+datastore stub (or a real datastore) must already be set up.
+
+"""
+
+import random
+from bisect import bisect_left
+from datetime import date
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+import wishlist
+
+CITIES = ['London', 'San Francisco', 'New York', 'Berlin', 'Tokyo', 'Paris',
+          'Chicago', 'Sydney', 'Toronto', 'Bangalore', 'Sao Paulo', 'Madrid',
+          'Seoul', 'Amsterdam', 'Dublin', 'Austin', 'Singapore', 'Zurich']
+# city centres; venues are spread up to CITY_SPREAD degrees around them
+CITY_COORDINATES = {
+    'London': (51.507, -0.128), 'San Francisco': (37.775, -122.419),
+    'New York': (40.713, -74.006), 'Berlin': (52.520, 13.405),
+    'Tokyo': (35.690, 139.692), 'Paris': (48.857, 2.352),
+    'Chicago': (41.878, -87.630), 'Sydney': (-33.869, 151.209),
+    'Toronto': (43.653, -79.383), 'Bangalore': (12.972, 77.595),
+    'Sao Paulo': (-23.551, -46.633), 'Madrid': (40.417, -3.704),
+    'Seoul': (37.567, 126.978), 'Amsterdam': (52.368, 4.904),
+    'Dublin': (53.350, -6.260), 'Austin': (30.267, -97.743),
+    'Singapore': (1.352, 103.820), 'Zurich': (47.377, 8.542),
+}
+CITY_SPREAD = 0.3
+TOPICS = ['Web Technologies', 'Programming Languages', 'Medical Innovations',
+          'Movie Making', 'Health and Nutrition', 'Machine Learning',
+          'Cloud Computing', 'Mobile', 'Security', 'Design', 'Databases',
+          'Robotics', 'Education', 'Finance', 'Open Source', 'Gaming']
+SESSION_TYPES = ['KEYNOTE', 'LECTURE', 'WORKSHOP', 'FORUM', 'PANEL',
+                 'DEMONSTRATION', 'PERFORMANCE', 'NOT_SPECIFIED']
+DURATIONS = [15, 30, 45, 60, 90, 120]
+
+
+class Config(object):
+    """The volumes and shape of a generated dataset."""
+
+    def __init__(self, profiles=1000, conferences=200, sessions=20,
+                 hot_conferences=3, hot_registrants=2000,
+                 registrations=3, wishlist_users=50, wishlist_length=200,
+                 speakers=500, skew=1.1, seed=1, batch_size=500,
+                 parallel_batches=4):
+        self.profiles = profiles
+        self.conferences = conferences
+        self.sessions = sessions                # per conference
+        self.hot_conferences = hot_conferences
+        self.hot_registrants = hot_registrants  # per hot conference
+        self.registrations = registrations      # mean, per other profile
+        self.wishlist_users = wishlist_users
+        self.wishlist_length = wishlist_length
+        self.speakers = speakers
+        self.skew = skew                        # Zipf exponent
+        self.seed = seed
+        self.batch_size = batch_size
+        self.parallel_batches = parallel_batches
+
+
+class Zipf(object):
+    """Draws items with probability proportional to 1 / rank ** skew."""
+
+    def __init__(self, items, skew, rng):
+        self.items = items
+        self.rng = rng
+        total = 0.0
+        self.cumulative = []
+        for rank in range(1, len(items) + 1):
+            total += 1.0 / rank ** skew
+            self.cumulative.append(total)
+
+    def draw(self):
+        target = self.rng.random() * self.cumulative[-1]
+        return self.items[bisect_left(self.cumulative, target)]
+
+    def sample(self, k):
+        """Draw k distinct items."""
+        k = min(k, len(self.items))
+        chosen = []
+        while len(chosen) < k:
+            item = self.draw()
+            if item not in chosen:
+                chosen.append(item)
+        return chosen
+
+
+class Dataset(object):
+    """The keys of a generated dataset."""
+
+    def __init__(self):
+        self.profile_keys = []
+        self.conference_keys = []
+        self.hot_conference_keys = []
+        self.session_keys = []
+
+    def organizer(self, conf_key):
+        """Return the user id organizing a conference."""
+        return conf_key.parent().id()
+
+
+def userId(i):
+    return 'user%d@example.com' % i
+
+
+def putMulti(entities, config):
+    """Write entities in batches, with several batches in flight at once."""
+    in_flight = []
+    for start in range(0, len(entities), config.batch_size):
+        batch = entities[start:start + config.batch_size]
+        in_flight.append(ndb.put_multi_async(batch))
+        if len(in_flight) >= config.parallel_batches:
+            for future in in_flight.pop(0):
+                future.get_result()
+    for futures in in_flight:
+        for future in futures:
+            future.get_result()
+
+
+def reserveIds(entities):
+    """
+        Reserve the explicit ids of entities, so ids the datastore allocates
+        later for new entities of the same kind and parent don't collide.
+    """
+    highest = {}
+    for entity in entities:
+        group = (type(entity), entity.key.parent())
+        highest[group] = max(highest.get(group, 0), entity.key.id())
+    futures = [model.allocate_ids_async(max=top, parent=parent)
+               for (model, parent), top in highest.items()]
+    for future in futures:
+        future.get_result()
+
+
+def generate(config=None):
+    """
+        Generate and write a dataset.
+
+    :param config: Config describing the dataset, defaults to Config()
+    :return: Dataset with the keys of everything written
+    """
+    config = config or Config()
+    rng = random.Random(config.seed)
+    cities = Zipf(CITIES, config.skew, rng)
+    topics = Zipf(TOPICS, config.skew, rng)
+    speakers = Zipf(['Speaker %d' % i for i in range(config.speakers)],
+                    config.skew, rng)
+    dataset = Dataset()
+
+    profiles = [Profile(key=ndb.Key(Profile, userId(i)),
+                        displayName='User %d' % i,
+                        mainEmail=userId(i))
+                for i in range(config.profiles)]
+    dataset.profile_keys = [p.key for p in profiles]
+
+    # conferences, organized round robin; explicit ids keep keys stable
+    conferences = []
+    for i in range(config.conferences):
+        organizer = profiles[i % len(profiles)].key
+        start = date(2016, 1, 1) + timedelta(days=rng.randint(0, 729))
+        hot = i < config.hot_conferences
+        city = cities.draw()
+        latitude, longitude = CITY_COORDINATES[city]
+        conferences.append(Conference(
+                key=ndb.Key(Conference, i + 1, parent=organizer),
+                name='Conference %d' % i,
+                description='Synthetic conference %d' % i,
+                organizerUserId=organizer.id(),
+                topics=topics.sample(rng.randint(1, 4)),
+                city=city,
+                latitude=latitude + rng.uniform(-CITY_SPREAD, CITY_SPREAD),
+                longitude=longitude + rng.uniform(-CITY_SPREAD, CITY_SPREAD),
+                startDate=start,
+                month=start.month,
+                endDate=start + timedelta(days=rng.randint(0, 3)),
+                maxAttendees=(config.hot_registrants + 100 if hot
+                              else rng.choice([50, 100, 250, 500, 1000])),
+                seatsAvailable=0))
+    dataset.conference_keys = [c.key for c in conferences]
+    dataset.hot_conference_keys = dataset.conference_keys[
+            :config.hot_conferences]
+
+    # registrations: hot conferences take thousands of registrants, the
+    # rest are drawn with the same popularity skew
+    registered = dict((c.key, 0) for c in conferences)
+    popularity = Zipf(conferences, config.skew, rng)
+    for conf in conferences[:config.hot_conferences]:
+        for profile in rng.sample(profiles,
+                                  min(config.hot_registrants, len(profiles))):
+            profile.conferenceKeysToAttend.append(conf.key.urlsafe())
+            registered[conf.key] += 1
+    for profile in profiles:
+        for conf in popularity.sample(rng.randint(0,
+                                                  2 * config.registrations)):
+            wsck = conf.key.urlsafe()
+            if wsck not in profile.conferenceKeysToAttend and \
+                    registered[conf.key] < conf.maxAttendees:
+                profile.conferenceKeysToAttend.append(wsck)
+                registered[conf.key] += 1
+    for conf in conferences:
+        conf.seatsAvailable = conf.maxAttendees - registered[conf.key]
+
+    # sessions, with a few speakers giving most of the talks
+    sessions = []
+    for conf in conferences:
+        days = (conf.endDate - conf.startDate).days
+        for j in range(config.sessions):
+            sessions.append(Session(
+                    key=ndb.Key(Session, j + 1, parent=conf.key),
+                    name='Session %d' % j,
+                    highlights='Synthetic session %d' % j,
+                    speaker=speakers.sample(rng.choice([1, 1, 1, 2])),
+                    duration=rng.choice(DURATIONS),
+                    type_of_session=rng.choice(SESSION_TYPES),
+                    date=conf.startDate + timedelta(
+                            days=rng.randint(0, days)),
+                    start_time=rng.randint(8, 20) * 100 +
+                    rng.choice([0, 15, 30, 45]),
+                    conference_id=conf.key.id()))
+    dataset.session_keys = [s.key for s in sessions]
+
+    # long wishlists, drawn from the hot conferences' sessions first
+    by_conference = {}
+    for session in sessions:
+        by_conference.setdefault(session.key.parent(), []).append(session)
+    candidates = []
+    for conf_key in dataset.hot_conference_keys + dataset.conference_keys:
+        candidates.extend(by_conference.get(conf_key, []))
+        if len(candidates) >= config.wishlist_length * 2:
+            break
+    for profile in profiles[:config.wishlist_users]:
+        chosen = rng.sample(candidates,
+                            min(config.wishlist_length, len(candidates)))
+        profile.sessionKeysInWishlist = [s.key.urlsafe() for s in chosen]
+        profile.wishlistSchedule = wishlist.buildSchedule(chosen)
+
+    reserveIds(conferences)
+    reserveIds(sessions)
+    putMulti(profiles, config)
+    putMulti(conferences, config)
+    putMulti(sessions, config)
+    return dataset
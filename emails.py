@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+"""
+emails.py -- the emails sent from task handlers
+
+Only needs the mail API, so the email tasks start without loading the
+datastore models or the endpoints API.
+
+"""
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+
+
+def _sender():
+    return 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+
+
+def sendConfirmationEmail(email, conferenceInfo):
+    """Send email confirming Conference creation."""
+    mail.send_mail(
+        _sender(),                                  # from
+        email,                                      # to
+        'You created a new Conference!',            # subj
+        'Hi, you have created a following '         # body
+        'conference:\r\n\r\n%s' % conferenceInfo
+    )
+
+
+def sendImportFinishedEmail(email, totalRows, rowsImported, rowsFailed):
+    """Send email telling an organizer their bulk import has finished."""
+    mail.send_mail(
+        _sender(),                                  # from
+        email,                                      # to
+        'Your conference import has finished',      # subj
+        'Hi, your import of %d rows has finished: %d conferences '
+        'were created and %d rows failed.' % (      # body
+            totalRows, rowsImported, rowsFailed)
+    )
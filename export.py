@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+export.py -- bulk export of Conferences and their Sessions
+
+Conferences are read in cursor-sized chunks, their Sessions fetched in
+parallel per chunk, and the records are formatted as they are read. The
+python27 runtime buffers the whole response before sending it, though, so
+what bounds the memory and time of one request is the limit on the number
+of conferences. After each chunk a cursor record is emitted; passing its
+cursor back resumes the export right after that chunk.
+
+"""
+
+import csv
+import json
+from cStringIO import StringIO
+
+from models import Conference
+from models import Session
+
+CHUNK_SIZE = 100          # conferences per datastore page
+DEFAULT_LIMIT = 5000      # conferences per response, resume with the cursor
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CONFERENCE_FIELDS = ('name', 'description', 'organizerUserId', 'topics',
+                     'city', 'startDate', 'endDate', 'maxAttendees',
+                     'seatsAvailable', 'latitude', 'longitude')
+SESSION_FIELDS = ('name', 'highlights', 'speaker', 'duration',
+                  'type_of_session', 'date', 'start_time')
+CSV_COLUMNS = ('record', 'websafeKey', 'websafeConferenceKey', 'cursor',
+               'registrations') + CONFERENCE_FIELDS + tuple(
+               f for f in SESSION_FIELDS if f not in CONFERENCE_FIELDS)
+
+
+def _value(value):
+    """Return a JSON friendly version of a property value."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def records(cursor=None, limit=DEFAULT_LIMIT, chunk_size=CHUNK_SIZE):
+    """
+        Yield the export as dicts, each with a 'record' type: 'conference',
+        'session' or 'cursor'.
+
+    :param cursor: Cursor of a previous export to resume from, or None
+    :param limit: the number of conferences after which to stop
+    :param chunk_size: the number of conferences read per page
+    """
+    query = Conference.query().order(Conference.key)
+    start = cursor
+    exported = 0
+    while exported < limit:
+        confs, start, more = query.fetch_page(
+                min(chunk_size, limit - exported), start_cursor=start)
+        futures = [Session.query(ancestor=conf.key).fetch_async()
+                   for conf in confs]
+        for conf, future in zip(confs, futures):
+            wsck = conf.key.urlsafe()
+            record = dict((f, _value(getattr(conf, f)))
+                          for f in CONFERENCE_FIELDS)
+            record.update(record='conference', websafeKey=wsck,
+                          registrations=(conf.maxAttendees or 0) -
+                          (conf.seatsAvailable or 0))
+            yield record
+            for session in future.get_result():
+                record = dict((f, _value(getattr(session, f)))
+                              for f in SESSION_FIELDS)
+                record.update(record='session',
+                              websafeKey=session.key.urlsafe(),
+                              websafeConferenceKey=wsck)
+                yield record
+        exported += len(confs)
+        if not more or not start:
+            break
+        yield {'record': 'cursor', 'cursor': start.urlsafe()}
+
+
+def _csvValue(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        value = ';'.join(unicode(v) for v in value)
+    return unicode(value).encode('utf-8')
+
+
+def ndjson(rows):
+    """Format records as newline delimited JSON."""
+    for row in rows:
+        yield json.dumps(row, sort_keys=True) + '\n'
+
+
+def csvLines(rows):
+    """Format records as CSV lines with a header row."""
+    out = StringIO()
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    yield out.getvalue()
+    out.seek(0)
+    out.truncate()
+    for row in rows:
+        writer.writerow([_csvValue(row.get(column))
+                         for column in CSV_COLUMNS])
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+
+def stream(fmt, cursor=None, limit=DEFAULT_LIMIT):
+    """Return a generator of the formatted export, from a Cursor or None."""
+    rows = records(cursor, limit)
+    if fmt == 'csv':
+        return csvLines(rows)
+    return ndjson(rows)
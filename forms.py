@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+"""
+forms.py -- copying of datastore entities into their outbound forms
+
+Kept apart from conference.py so the cron jobs that cache ready-made forms
+(upcoming.py, recommendations.py) don't import the endpoints API to build
+them.
+
+"""
+
+from models import ConferenceForm
+
+
+def conferenceForm(conf, displayName, fields=None):
+    """Copy relevant fields from Conference to ConferenceForm.
+
+    If a field mask is given only the fields in it are copied.
+    """
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if fields and field.name not in fields:
+            continue
+        if hasattr(conf, field.name):
+            # convert Date to date string; just copy others
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    if displayName and (not fields or 'organizerDisplayName' in fields):
+        setattr(cf, 'organizerDisplayName', displayName)
+    cf.check_initialized()
+    return cf
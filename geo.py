@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+geo.py -- geohash index for "conferences near me" searches
+
+A geohash interleaves the bits of a longitude and a latitude into a base 32
+string; every prefix of it names a cell containing the point, and a longer
+prefix a smaller cell. A Conference with coordinates stores all prefixes of
+its geohash up to PRECISION in a repeated property, so the conferences of a
+cell are a single equality scan at any cell size. A radius search picks the
+smallest cells of which a handful cover the circle's bounding box, scans
+those, and keeps the conferences within the radius by their great circle
+distance.
+
+"""
+
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 7           # longest prefix stored, cells of about 150m
+MAX_CELLS = 16          # cells scanned per radius search
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def validCoordinates(latitude, longitude):
+    """Whether latitude and longitude are both given and in range."""
+    return latitude is not None and longitude is not None and \
+        -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Return the geohash of a point, precision characters long."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True     # bits alternate, starting with a longitude bit
+    while len(chars) < precision:
+        interval, coordinate = (lng_range, longitude) if even else \
+            (lat_range, latitude)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cellSize(precision):
+    """Return the (height, width) in degrees of the cells of a precision."""
+    bits = 5 * precision
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def geohashPrefixes(latitude, longitude):
+    """Return every prefix of a point's geohash, or [] without a point."""
+    if not validCoordinates(latitude, longitude):
+        return []
+    geohash = encode(latitude, longitude)
+    return [geohash[:n] for n in range(1, PRECISION + 1)]
+
+
+def distanceKm(lat1, lng1, lat2, lng2):
+    """Return the great circle (haversine) distance between two points."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * \
+        math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _boundingBox(latitude, longitude, radius_km):
+    """Return (south, north, west, east) of a circle. West and east are not
+    wrapped, so they may lie beyond +-180 across the antimeridian; a box
+    reaching a pole spans every longitude."""
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = latitude - dlat, latitude + dlat
+    if south <= -90 or north >= 90:
+        return max(south, -90.0), min(north, 90.0), -180.0, 180.0
+    # the box is widest in degrees at its edge nearest to a pole
+    dlng = dlat / math.cos(math.radians(max(abs(south), abs(north))))
+    if dlng >= 180:
+        return south, north, -180.0, 180.0
+    return south, north, longitude - dlng, longitude + dlng
+
+
+def coveringCells(latitude, longitude, radius_km):
+    """
+        Return the geohash cells that together cover a circle: the longest
+        prefixes for which the circle's bounding box takes at most MAX_CELLS
+        cells. An empty list means the circle is too large for that and
+        everything has to be scanned.
+    """
+    south, north, west, east = _boundingBox(latitude, longitude, radius_km)
+    for precision in range(PRECISION, 0, -1):
+        height, width = cellSize(precision)
+        rows = 2 ** ((5 * precision) // 2)
+        cols = 2 ** ((5 * precision + 1) // 2)
+        first_row = int((south + 90) / height)
+        last_row = min(int((north + 90) / height), rows - 1)
+        first_col = int(math.floor((west + 180) / width))
+        last_col = int(math.floor((east + 180) / width))
+        if east - west >= 360:
+            first_col, last_col = 0, cols - 1
+        if (last_row - first_row + 1) * (last_col - first_col + 1) > \
+                MAX_CELLS:
+            continue
+        # a cell is named by the geohash of its centre
+        return sorted(
+            encode(-90 + (row + 0.5) * height,
+                   -180 + (col % cols + 0.5) * width, precision)
+            for row in range(first_row, last_row + 1)
+            for col in range(first_col, last_col + 1))
+    return []
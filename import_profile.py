@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+import_profile.py -- report what importing each app module costs
+
+A new instance pays for its imports on its first request, so this imports
+every handler's modules in a fresh interpreter (nothing is shared between
+them, as on a cold instance) and reports the wall time and the number of
+modules each one loads, slowest first:
+
+    $ python import_profile.py --sdk ~/google-cloud-sdk/platform/google_appengine
+
+The SDK path can also be given with the APPENGINE_SDK environment variable.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ['main', 'conference', 'announcements', 'emails', 'models',
+           'export', 'importer', 'instrumentation', 'mapper',
+           'recommendations', 'seatpush', 'upcoming', 'waitlist',
+           'validation', 'forms']
+
+# run in the child interpreter; prints {"seconds": ..., "modules": ...}
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, %(here)r)
+from benchmark import setupPaths
+setupPaths(%(sdk)r)
+before = len(sys.modules)
+start = time.time()
+__import__(%(module)r)
+print(json.dumps({"seconds": time.time() - start,
+                  "modules": len(sys.modules) - before}))
+'''
+
+
+def profileImport(module, sdk, repeat):
+    """Return the best import time of a module and the modules it loads."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(repeat):
+        out = subprocess.check_output(
+                [sys.executable, '-c', CHILD % dict(
+                    here=here, sdk=sdk, module=module)])
+        results.append(json.loads(out.decode('utf-8').splitlines()[-1]))
+    return min(results, key=lambda r: r['seconds'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sdk', help='path to the App Engine SDK')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='imports per module; the fastest is reported')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args()
+    sdk = args.sdk or os.environ.get('APPENGINE_SDK')
+
+    report = [(module, profileImport(module, sdk, args.repeat))
+              for module in args.modules]
+    report.sort(key=lambda item: -item[1]['seconds'])
+    print('%-16s %10s %8s' % ('module', 'ms', 'modules'))
+    for module, result in report:
+        print('%-16s %10.1f %8d' % (module, result['seconds'] * 1000,
+                                    result['modules']))
+
+
+if __name__ == '__main__':
+    main()
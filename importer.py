@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""
+importer.py -- bulk Conference import via task-queue fan-out
+
+An uploaded CSV or JSON file is split into ImportChunks under an ImportJob;
+one task per chunk validates its rows in a single pass (defaults, types,
+dates), allocates all the Conference ids it needs at once and writes the
+conferences with put_multi. Per-row errors are kept on the chunk and the
+job counts progress, which /admin/import/status reports.
+
+"""
+
+import csv
+import json
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from geo import validCoordinates
+from models import Conference
+from models import DEFAULTS_CONF
+from models import ImportChunk
+from models import ImportJob
+from models import Profile
+from validation import parseDates
+
+IMPORT_CHUNK_URL = '/tasks/import_chunk'
+CHUNK_SIZE = 200
+TASK_BATCH = 100        # tasks per taskqueue.Queue.add() call
+
+
+def parseUpload(content, fmt):
+    """
+        Parse an uploaded file into a list of row dicts.
+
+    :param content: the file content
+    :param fmt: 'csv' (with a header row; topics separated by ';') or
+                'json' (a list of objects)
+    :return: list of dicts
+    """
+    if fmt == 'json':
+        rows = json.loads(content)
+        if not isinstance(rows, list):
+            raise ValueError('JSON imports must be a list of objects')
+        return rows
+    rows = []
+    for row in csv.DictReader(content.splitlines()):
+        if row.get('topics'):
+            row['topics'] = [t.strip() for t in row['topics'].split(';')
+                             if t.strip()]
+        rows.append(row)
+    return rows
+
+
+def _text(row, field):
+    """Return a string field of a row, None when empty."""
+    value = row.get(field)
+    if value in (None, ''):
+        return None
+    if not isinstance(value, basestring):
+        raise ValueError("'%s' must be a string" % field)
+    return value
+
+
+def prepareRows(rows):
+    """
+        Turn raw rows into Conference property dicts, applying the
+        createConference defaults and conversions. Dates are parsed a
+        column at a time.
+
+    :param rows: list of row dicts
+    :return: (list of (index, data) for the valid rows,
+              list of (index, error message) for the others)
+    """
+    candidates = []
+    errors = []
+    for i, row in enumerate(rows):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('row is not an object')
+            name = (_text(row, 'name') or '').strip()
+            if not name:
+                raise ValueError("Conference 'name' field required")
+            data = {
+                'name': name,
+                'description': _text(row, 'description'),
+                'city': _text(row, 'city'),
+                'topics': row.get('topics') or [],
+                'maxAttendees': int(row['maxAttendees'])
+                if row.get('maxAttendees') not in (None, '') else None,
+                'startDate': row.get('startDate') or None,
+                'endDate': row.get('endDate') or None,
+                'latitude': float(row['latitude'])
+                if row.get('latitude') not in (None, '') else None,
+                'longitude': float(row['longitude'])
+                if row.get('longitude') not in (None, '') else None,
+            }
+            if isinstance(data['topics'], basestring):
+                data['topics'] = [data['topics']]
+            if not isinstance(data['topics'], list) or not all(
+                    isinstance(t, basestring) for t in data['topics']):
+                raise ValueError("'topics' must be a list of strings")
+            for df in DEFAULTS_CONF:
+                if data.get(df) in (None, []):
+                    data[df] = DEFAULTS_CONF[df]
+            for df in ('startDate', 'endDate'):
+                if data[df] is not None and \
+                        not isinstance(data[df], basestring):
+                    raise ValueError("'%s' must be a string" % df)
+            if (data['latitude'], data['longitude']) != (None, None) and \
+                    not validCoordinates(data['latitude'], data['longitude']):
+                raise ValueError("'latitude' and 'longitude' must be given "
+                                 "together and be in range")
+            if data['maxAttendees'] > 0:
+                data['seatsAvailable'] = data['maxAttendees']
+            candidates.append((i, data))
+        except (ValueError, TypeError, KeyError) as e:
+            errors.append((i, str(e)))
+
+    columns = {}
+    for df in ('startDate', 'endDate'):
+        columns[df] = parseDates([data[df] for i, data in candidates])
+    prepared = []
+    for n, (i, data) in enumerate(candidates):
+        bad = [df for df in ('startDate', 'endDate') if columns[df][1][n]]
+        if bad:
+            errors.append((i, "'%s' must be formatted as YYYY-MM-DD" %
+                           bad[0]))
+            continue
+        for df in ('startDate', 'endDate'):
+            data[df] = columns[df][0][n]
+        data['month'] = data['startDate'].month if data['startDate'] else 0
+        prepared.append((i, data))
+    errors.sort()
+    return prepared, errors
+
+
+def startImport(rows, user_id, email):
+    """
+        Store the rows as chunks of a new ImportJob and queue one task per
+        chunk.
+
+    :param rows: list of row dicts, as returned by parseUpload()
+    :param user_id: the organizer the conferences are created for
+    :param email: where to send the completion email
+    :return: key of the ImportJob
+    """
+    job = ImportJob(organizerUserId=user_id, organizerEmail=email,
+                    totalRows=len(rows),
+                    chunks=(len(rows) + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    job.put()
+    chunks = [ImportChunk(parent=job.key, id=n + 1, firstRow=start,
+                          rows=rows[start:start + CHUNK_SIZE])
+              for n, start in enumerate(range(0, len(rows), CHUNK_SIZE))]
+    ndb.put_multi(chunks)
+
+    tasks = [taskqueue.Task(url=IMPORT_CHUNK_URL,
+                            params={'job': job.key.urlsafe(),
+                                    'chunk': chunk.key.id()})
+             for chunk in chunks]
+    queue = taskqueue.Queue()
+    for start in range(0, len(tasks), TASK_BATCH):
+        queue.add(tasks[start:start + TASK_BATCH])
+    return job.key
+
+
+@ndb.transactional()
+def _finishChunk(chunk_key, errors, imported):
+    """
+        Mark a chunk done and count it on its job (same entity group), so a
+        retry after a failure here redoes both.
+
+    :return: the job once every chunk is done, otherwise None
+    """
+    chunk = chunk_key.get()
+    if chunk.done:
+        return None
+    chunk.errors = errors
+    chunk.done = True
+    job = chunk_key.parent().get()
+    job.chunksDone += 1
+    job.rowsImported += imported
+    job.rowsFailed += len(errors)
+    ndb.put_multi([chunk, job])
+    return job if job.chunksDone == job.chunks else None
+
+
+def processChunk(job_key, chunk_id):
+    """
+        Import the rows of one chunk. Safe to retry: the Conference ids are
+        allocated once and stored on the chunk, so a rerun overwrites the
+        same entities.
+
+    :param job_key: key of the ImportJob
+    :param chunk_id: id of the ImportChunk under it
+    :return: the ImportJob if this was its last chunk, otherwise None
+    """
+    job = job_key.get()
+    chunk = ndb.Key(ImportChunk, chunk_id, parent=job_key).get()
+    if not job or not chunk or chunk.done:
+        return None
+
+    prepared, errors = prepareRows(chunk.rows)
+    p_key = ndb.Key(Profile, job.organizerUserId)
+    if len(chunk.conferenceIds) < len(prepared):
+        first, last = Conference.allocate_ids(size=len(prepared),
+                                              parent=p_key)
+        chunk.conferenceIds = range(first, last + 1)
+        chunk.put()
+
+    conferences = []
+    for conf_id, (i, data) in zip(chunk.conferenceIds, prepared):
+        data['key'] = ndb.Key(Conference, conf_id, parent=p_key)
+        data['organizerUserId'] = job.organizerUserId
+        try:
+            conferences.append(Conference(**data))
+        except datastore_errors.BadValueError as e:
+            # e.g. a string over the indexed property length limit
+            errors.append((i, str(e)))
+    ndb.put_multi(conferences)
+
+    errors.sort()
+    return _finishChunk(chunk.key,
+                        [{'row': chunk.firstRow + i, 'error': error}
+                         for i, error in errors],
+                        len(conferences))
+
+
+def importStatus(job_key):
+    """Return the progress and per-row errors of an ImportJob as a dict."""
+    job = job_key.get()
+    if not job:
+        return None
+    errors = []
+    for chunk in ImportChunk.query(ancestor=job_key):
+        if chunk.done:
+            errors.extend(chunk.errors or [])
+    return {
+        'totalRows': job.totalRows,
+        'chunks': job.chunks,
+        'chunksDone': job.chunksDone,
+        'rowsImported': job.rowsImported,
+        'rowsFailed': job.rowsFailed,
+        'done': job.chunksDone == job.chunks,
+        'errors': sorted(errors, key=lambda e: e['row']),
+    }
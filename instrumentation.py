@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""
+instrumentation.py -- latency and RPC accounting for ConferenceApi methods
+
+Every endpoints method is wrapped with @instrumented, which records its wall
+time, RPC counts per service, entities read and written and response size.
+The figures are aggregated per method in instance memory and periodically
+flushed to memcache counters, where the /admin/stats handler reads them.
+A method called from inside another one, as batch() does, is accounted to
+the outer method only.
+
+"""
+
+import functools
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from protorpc import protojson
+
+MEMCACHE_STATS_KEY = "STATS:%s:%s"
+FLUSH_INTERVAL = 60  # seconds between flushes to memcache, per instance
+
+# upper bounds (ms) of the latency histogram buckets; slower calls land in
+# the overflow bucket
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+OVERFLOW_BUCKET = 'inf'
+
+COUNTERS = ('calls', 'errors', 'wall_ms', 'entities_read',
+            'entities_written', 'response_bytes')
+RPC_SERVICES = ('datastore_v3', 'memcache', 'taskqueue', 'mail', 'urlfetch')
+
+_methods = []
+_local = threading.local()
+_lock = threading.Lock()
+_pending = {}
+_last_flush = [time.time()]
+
+
+def _rpcHook(service, call, request, response):
+    """apiproxy post-call hook counting the RPCs of instrumented calls."""
+    for stats in getattr(_local, 'stack', ()):
+        key = 'rpc_%s' % service
+        stats[key] = stats.get(key, 0) + 1
+        if service != 'datastore_v3':
+            continue
+        if call == 'Get':
+            stats['entities_read'] += response.entity_size()
+        elif call in ('RunQuery', 'Next'):
+            stats['entities_read'] += response.result_size()
+        elif call == 'Put':
+            stats['entities_written'] += request.entity_size()
+        elif call == 'Delete':
+            stats['entities_written'] += request.key_size()
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'instrumentation', _rpcHook)
+
+
+def _bucket(wall_ms):
+    for bound in LATENCY_BUCKETS_MS:
+        if wall_ms <= bound:
+            return str(bound)
+    return OVERFLOW_BUCKET
+
+
+def _record(method, stats):
+    """Add the stats of one call to the pending per-method aggregates."""
+    stats['lat_%s' % _bucket(stats['wall_ms'])] = 1
+    with _lock:
+        pending = _pending.setdefault(method, {})
+        for key, value in stats.items():
+            pending[key] = pending.get(key, 0) + value
+        due = time.time() - _last_flush[0] >= FLUSH_INTERVAL
+    if due:
+        flush()
+
+
+def flush():
+    """Push the pending aggregates of this instance to memcache."""
+    with _lock:
+        deltas = {}
+        for method, stats in _pending.items():
+            for key, value in stats.items():
+                deltas[MEMCACHE_STATS_KEY % (method, key)] = int(value)
+        _pending.clear()
+        _last_flush[0] = time.time()
+    if deltas:
+        try:
+            memcache.offset_multi(deltas, initial_value=0)
+        except Exception:
+            logging.exception('Could not flush method stats')
+
+
+def instrumented(func):
+    """Decorator recording the latency and RPCs of an endpoints method."""
+    method = func.__name__
+    _methods.append(method)
+
+    @functools.wraps(func)
+    def wrapper(self, request):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            # nested, e.g. in a batch: the outer method counts it already
+            return func(self, request)
+        stats = dict((counter, 0) for counter in COUNTERS)
+        stats['calls'] = 1
+        stack.append(stats)
+        start = time.time()
+        try:
+            response = func(self, request)
+            stats['response_bytes'] = len(protojson.encode_message(response))
+            return response
+        except Exception:
+            stats['errors'] = 1
+            raise
+        finally:
+            stats['wall_ms'] = int((time.time() - start) * 1000)
+            stack.pop()
+            _record(method, stats)
+    return wrapper
+
+
+def _percentile(histogram, calls, fraction):
+    """Estimate a latency percentile (ms) from the histogram buckets."""
+    seen = 0
+    for bound in LATENCY_BUCKETS_MS + (OVERFLOW_BUCKET,):
+        seen += histogram.get(str(bound), 0)
+        if calls and seen >= fraction * calls:
+            return bound
+    return None
+
+
+def getStats():
+    """
+        Return the aggregated stats of every instrumented method, as stored
+        in memcache.
+
+    :return: dict of method name to a dict of its counters, latency
+             histogram and estimated p50/p99
+    """
+    flush()
+    buckets = [str(b) for b in LATENCY_BUCKETS_MS] + [OVERFLOW_BUCKET]
+    keys = list(COUNTERS) + ['rpc_%s' % s for s in RPC_SERVICES] + \
+        ['lat_%s' % b for b in buckets]
+    cached = memcache.get_multi(
+            [MEMCACHE_STATS_KEY % (m, k) for m in _methods for k in keys])
+
+    report = {}
+    for method in _methods:
+        stats = dict((k, int(cached.get(MEMCACHE_STATS_KEY % (method, k), 0)))
+                     for k in keys)
+        if not stats['calls']:
+            continue
+        histogram = dict((b, stats.pop('lat_%s' % b)) for b in buckets)
+        stats['latency_histogram_ms'] = histogram
+        stats['mean_ms'] = stats['wall_ms'] / float(stats['calls'])
+        stats['p50_ms'] = _percentile(histogram, stats['calls'], 0.5)
+        stats['p99_ms'] = _percentile(histogram, stats['calls'], 0.99)
+        report[method] = stats
+    return report
@@ -12,16 +12,61 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
-from conference import ConferenceApi
+
+# Only what every handler needs is imported here; each handler imports its
+# own modules, so a new instance serving a task or cron request does not
+# load the endpoints API (conference.py) unless it needs it. Warmup
+# requests import everything ahead of the first user request.
+WARMUP_MODULES = ('conference', 'announcements', 'emails', 'export',
+                  'importer', 'instrumentation', 'mapper', 'recommendations',
+                  'seatpush', 'tombstones', 'upcoming', 'waitlist')
+
+
+class WarmupHandler(webapp2.RequestHandler):
+    """Handler for the /_ah/warmup requests of new instances"""
+    def get(self):
+        """Import the modules the other handlers import lazily."""
+        for name in WARMUP_MODULES:
+            __import__(name)
+        self.response.set_status(200)
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     """Handler for setting the annoucement"""
     def get(self):
         """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        from announcements import cacheAnnouncement
+        cacheAnnouncement()
+        self.response.set_status(204)
+
+
+class SetRecommendationsHandler(webapp2.RequestHandler):
+    """Handler for precomputing conference recommendations"""
+    def get(self):
+        """Recompute every user's recommendations into memcache."""
+        import recommendations
+        recommendations.rebuild()
+        self.response.set_status(204)
+
+
+class SetUpcomingHandler(webapp2.RequestHandler):
+    """Handler for refreshing the upcoming conferences list"""
+    def get(self):
+        """Rebuild the cached list of upcoming conferences."""
+        import upcoming
+        upcoming.rebuild()
+        self.response.set_status(204)
+
+
+class PruneTombstonesHandler(webapp2.RequestHandler):
+    """Handler for deleting the expired session tombstones"""
+    def get(self):
+        """Delete the tombstones clients no longer sync past."""
+        from tombstones import pruneTombstones
+        pruneTombstones()
         self.response.set_status(204)
 
 
@@ -29,30 +74,199 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
     """Handler to send email confirmation"""
     def post(self):
         """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
+        from emails import sendConfirmationEmail
+        sendConfirmationEmail(self.request.get('email'),
+                              self.request.get('conferenceInfo'))
 
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     """Handler to set the featured speaker"""
     def post(self):
         """admin accessible request handler used to set the featured speaker"""
-        ConferenceApi._setFeaturedSpeaker(self.request.get('speaker'),
-                                          self.request.get('wsck'))
+        from announcements import setFeaturedSpeaker
+        setFeaturedSpeaker(self.request.get('speaker'),
+                           self.request.get('wsck'))
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    """Handler to promote waitlisted users into free seats"""
+    def post(self):
+        """Register the next batch of a conference's waitlist."""
+        from waitlist import promoteWaitlist
+        promoteWaitlist(self.request.get('wsck'),
+                        int(self.request.get('attempt') or 0))
+
+
+class PublishSeatsHandler(webapp2.RequestHandler):
+    """Handler publishing the coalesced seat count changes"""
+    def post(self):
+        """Publish the current seat count of a conference."""
+        import seatpush
+        seatpush.flush(self.request.get('wsck'))
+
+
+class SeatPushHandler(webapp2.RequestHandler):
+    """Handler long-polling for the seat count of a conference"""
+    def get(self):
+        """Return the seat count of ?wsck= once it is newer than
+        ?version=, or 204 when nothing changed in time."""
+        import seatpush
+        wsck = self.request.get('wsck')
+        try:
+            version = int(self.request.get('version') or 0)
+        except ValueError:
+            self.abort(400, 'version must be an integer')
+        if not wsck:
+            self.abort(400, 'wsck is required')
+        self.response.headers['Cache-Control'] = 'no-store'
+        update = seatpush.poll(wsck, version)
+        if update is None:
+            self.response.set_status(204)
+            return
+        update['websafeConferenceKey'] = wsck
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(update))
+
+
+class MethodStatsHandler(webapp2.RequestHandler):
+    """Handler reporting the ConferenceApi method stats"""
+    def get(self):
+        """admin only; return per-method latency and RPC stats as JSON."""
+        # importing conference registers its instrumented methods
+        import conference
+        from instrumentation import getStats
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(getStats(), indent=2, sort_keys=True))
+
+class ExportHandler(webapp2.RequestHandler):
+    """Handler exporting all Conferences and Sessions"""
+    def get(self):
+        """admin only; export as ?format=ndjson|csv, resumable from
+        ?cursor= and capped at ?limit= conferences per response. The
+        response is buffered, so the limit is what bounds its size."""
+        from google.appengine.api import datastore_errors
+        from google.appengine.datastore.datastore_query import Cursor
+        import export
+        fmt = self.request.get('format', 'ndjson')
+        if fmt not in export.FORMATS:
+            self.abort(400, 'format must be one of: %s' %
+                       ', '.join(sorted(export.FORMATS)))
+        try:
+            limit = int(self.request.get('limit', export.DEFAULT_LIMIT))
+        except ValueError:
+            self.abort(400, 'limit must be an integer')
+        cursor = None
+        if self.request.get('cursor'):
+            try:
+                cursor = Cursor(urlsafe=self.request.get('cursor'))
+            except datastore_errors.BadValueError:
+                self.abort(400, 'invalid cursor')
+        self.response.content_type = export.FORMATS[fmt]
+        self.response.app_iter = export.stream(fmt, cursor, limit)
+
+class ImportHandler(webapp2.RequestHandler):
+    """Handler starting a bulk Conference import"""
+    def post(self):
+        """admin only; import the uploaded 'file' (CSV or JSON) as
+        conferences organized by the current user."""
+        from google.appengine.api import users
+        import importer
+        upload = self.request.POST.get('file')
+        if upload is None or not hasattr(upload, 'file'):
+            self.abort(400, "a 'file' upload is required")
+        fmt = self.request.get('format') or (
+            'json' if upload.filename.lower().endswith('.json') else 'csv')
+        try:
+            rows = importer.parseUpload(upload.file.read(), fmt)
+        except ValueError as e:
+            self.abort(400, 'could not parse the upload: %s' % e)
+        user = users.get_current_user()
+        job_key = importer.startImport(rows, user.email(), user.email())
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'job': job_key.urlsafe(),
+                                        'rows': len(rows)}))
+
 
+class ImportStatusHandler(webapp2.RequestHandler):
+    """Handler reporting the progress of a bulk import"""
+    def get(self):
+        """admin only; return progress and per-row errors of ?job=."""
+        from google.appengine.ext import ndb
+        import importer
+        status = importer.importStatus(ndb.Key(urlsafe=self.request.get('job')))
+        if status is None:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(status, indent=2))
+
+
+class ImportChunkHandler(webapp2.RequestHandler):
+    """Handler importing one chunk of a bulk import"""
+    def post(self):
+        """Import the chunk; mail the organizer when the job is done."""
+        from google.appengine.ext import ndb
+        from emails import sendImportFinishedEmail
+        import importer
+        job = importer.processChunk(ndb.Key(urlsafe=self.request.get('job')),
+                                    int(self.request.get('chunk')))
+        if job:
+            sendImportFinishedEmail(job.organizerEmail, job.totalRows,
+                                    job.rowsImported, job.rowsFailed)
+
+class MapperHandler(webapp2.RequestHandler):
+    """Handler starting a mapper or reporting its progress"""
+    def get(self):
+        """admin only; return the progress of ?job=."""
+        from google.appengine.ext import ndb
+        import mapper
+        status = mapper.jobStatus(ndb.Key(urlsafe=self.request.get('job')))
+        if status is None:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(status, indent=2))
+
+    def post(self):
+        """admin only; start the mapper ?name= over ?shards= ranges."""
+        import mapper
+        name = self.request.get('name')
+        if name not in mapper.MAPPERS:
+            self.abort(400, 'known mappers: %s' % ', '.join(
+                    sorted(mapper.MAPPERS)))
+        job_key = mapper.startJob(
+                name, int(self.request.get('shards') or
+                          mapper.DEFAULT_SHARDS))
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'job': job_key.urlsafe()}))
+
+
+class MapperShardHandler(webapp2.RequestHandler):
+    """Handler running one slice of a mapper shard"""
+    def post(self):
+        """Map the next pages of the shard."""
+        from google.appengine.ext import ndb
+        import mapper
+        mapper.runShard(ndb.Key(urlsafe=self.request.get('shard')),
+                        int(self.request.get('slice')))
 
 
 app = webapp2.WSGIApplication(
     [
+        ('/_ah/warmup', WarmupHandler),
         ('/crons/set_announcement', SetAnnouncementHandler),
+        ('/crons/set_recommendations', SetRecommendationsHandler),
+        ('/crons/set_upcoming', SetUpcomingHandler),
+        ('/crons/prune_tombstones', PruneTombstonesHandler),
         ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
         ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+        ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+        ('/tasks/import_chunk', ImportChunkHandler),
+        ('/tasks/mapper', MapperShardHandler),
+        ('/tasks/publish_seats', PublishSeatsHandler),
+        ('/push/seats', SeatPushHandler),
+        ('/admin/stats', MethodStatsHandler),
+        ('/admin/export', ExportHandler),
+        ('/admin/import', ImportHandler),
+        ('/admin/import/status', ImportStatusHandler),
+        ('/admin/mapper', MapperHandler),
     ],
     debug=True)
 
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+"""
+mapper.py -- parallel datastore mappers for backfills and recomputations
+
+A mapper is a function run over every entity of a kind. A MapperJob splits
+the kind's key space into ranges using the datastore's __scatter__ sample
+and processes each range as a MapperShard in its own chain of tasks. A shard
+reads its range in key order one page at a time and writes what the mapper
+returns with put_multi. After every page it checkpoints its cursor, so a
+retried or restarted task picks up from the last page. Each task works for
+a limited time and then hands over to a continuation task; the checkpoint
+and the new task are committed in one transaction, which also checks that
+no duplicate of the task has moved the shard on already. Mappers must be
+idempotent, since after a failure the last page may be mapped twice.
+
+"""
+
+import time
+from datetime import datetime
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import MapperJob
+from models import MapperShard
+from models import Session
+
+MAPPER_URL = '/tasks/mapper'
+MEMCACHE_BACKFILL_KEY = "BACKFILL_DONE:%s"
+BACKFILL_CHECK_TTL = 60  # seconds a "not done yet" answer is reused
+DEFAULT_SHARDS = 8
+MAX_SHARDS = 64
+OVERSAMPLE = 32         # __scatter__ keys sampled per shard boundary
+BATCH_SIZE = 100        # entities read and written per page
+SLICE_SECONDS = 60      # work per task before handing over
+
+# name -> (model class, map function)
+MAPPERS = {}
+
+
+def mapper(name, model):
+    """
+        Register a map function under a name. The function gets an entity
+        and returns the entity (or list of entities) to write, or None when
+        nothing needs writing.
+    """
+    def register(func):
+        MAPPERS[name] = (model, func)
+        return func
+    return register
+
+
+def _splitKeyRange(model, shards):
+    """
+        Return shards + 1 boundaries splitting the keys of a kind into
+        ranges of similar size; the first and last are None (open ended).
+    """
+    if shards < 2:
+        return [None, None]
+    sample = model.query().order(ndb.GenericProperty('__scatter__')).fetch(
+            shards * OVERSAMPLE, keys_only=True)
+    sample.sort()
+    if len(sample) < shards:
+        return [None, None]
+    step = len(sample) / float(shards)
+    boundaries = [sample[int(step * i)] for i in range(1, shards)]
+    # duplicates would only make empty ranges
+    boundaries = sorted(set(boundaries))
+    return [None] + boundaries + [None]
+
+
+def _task(shard_key, slice_):
+    return taskqueue.Task(url=MAPPER_URL,
+                          params={'shard': shard_key.urlsafe(),
+                                  'slice': slice_})
+
+
+def startJob(name, shards=DEFAULT_SHARDS):
+    """
+        Start running a registered mapper.
+
+    :param name: the mapper's registered name
+    :param shards: the number of key ranges processed in parallel
+    :return: key of the MapperJob
+    """
+    if name not in MAPPERS:
+        raise ValueError('No mapper named %s' % name)
+    model = MAPPERS[name][0]
+    boundaries = _splitKeyRange(model, max(1, min(shards, MAX_SHARDS)))
+    job = MapperJob(name=name, kind=model._get_kind(),
+                    shards=len(boundaries) - 1)
+    job.put()
+    ranges = [MapperShard(parent=job.key, id=n + 1, startKey=start,
+                          endKey=end)
+              for n, (start, end) in enumerate(zip(boundaries,
+                                                   boundaries[1:]))]
+    ndb.put_multi(ranges)
+    taskqueue.Queue().add([_task(shard.key, 0) for shard in ranges])
+    return job.key
+
+
+def _current(shard, slice_):
+    """Whether the stored shard is still at slice_ and not done."""
+    stored = shard.key.get()
+    return stored is not None and not stored.done and \
+        stored.slice == slice_
+
+
+@ndb.transactional()
+def _handOver(shard, slice_):
+    """Checkpoint a shard and queue the task continuing it, unless a
+    duplicate task has moved it past slice_ already."""
+    if not _current(shard, slice_):
+        return
+    shard.slice = slice_ + 1
+    shard.put()
+    _task(shard.key, shard.slice).add(transactional=True)
+
+
+@ndb.transactional()
+def _finishShard(shard, slice_):
+    """Mark a shard done and count it on its job (same entity group),
+    unless a duplicate task has done so or moved it on already."""
+    if not _current(shard, slice_):
+        return
+    shard.done = True
+    shard.put()
+    job = shard.key.parent().get()
+    job.shardsDone += 1
+    if job.shardsDone == job.shards:
+        job.finished = datetime.now()
+    job.put()
+
+
+def _writes(result):
+    if result is None:
+        return []
+    if isinstance(result, (list, tuple)):
+        return list(result)
+    return [result]
+
+
+def runShard(shard_key, slice_):
+    """
+        Work on a shard for up to SLICE_SECONDS, from its last checkpoint.
+
+    :param shard_key: ndb.Key of the MapperShard
+    :param slice_: the slice the task was queued for; stale or duplicate
+                   tasks are ignored
+    """
+    shard = shard_key.get()
+    if not shard or shard.done or shard.slice != slice_:
+        return
+    job = shard_key.parent().get()
+    model, func = MAPPERS[job.name]
+
+    query = model.query()
+    if shard.startKey:
+        query = query.filter(model.key >= shard.startKey)
+    if shard.endKey:
+        query = query.filter(model.key < shard.endKey)
+    query = query.order(model.key)
+
+    deadline = time.time() + SLICE_SECONDS
+    cursor = Cursor(urlsafe=shard.cursor) if shard.cursor else None
+    more = True
+    while more and time.time() < deadline:
+        entities, cursor, more = query.fetch_page(BATCH_SIZE,
+                                                  start_cursor=cursor)
+        writes = []
+        for entity in entities:
+            writes.extend(_writes(func(entity)))
+        if writes:
+            ndb.put_multi(writes)
+        shard.processed += len(entities)
+        shard.written += len(writes)
+        shard.cursor = cursor.urlsafe() if cursor else None
+        more = more and cursor is not None
+        if more:
+            shard.put()
+
+    if more:
+        _handOver(shard, slice_)
+        return
+    _finishShard(shard, slice_)
+
+
+def jobStatus(job_key):
+    """Return the progress and throughput of a MapperJob as a dict."""
+    job = job_key.get()
+    if not job:
+        return None
+    shards = MapperShard.query(ancestor=job_key).fetch()
+    processed = sum(s.processed for s in shards)
+    end = job.finished or datetime.now()
+    elapsed = max((end - job.created).total_seconds(), 0.001)
+    return {
+        'name': job.name,
+        'kind': job.kind,
+        'shards': job.shards,
+        'shardsDone': job.shardsDone,
+        'done': job.finished is not None,
+        'processed': processed,
+        'written': sum(s.written for s in shards),
+        'elapsedSeconds': round(elapsed, 1),
+        'entitiesPerSecond': round(processed / elapsed, 1),
+    }
+
+
+def backfillDone(name):
+    """
+        Whether a job of the named mapper has run to completion, so that
+        queries may rely on what it backfilled. Cached in memcache: for
+        good once it is done, briefly until then.
+    """
+    key = MEMCACHE_BACKFILL_KEY % name
+    done = memcache.get(key)
+    if done is None:
+        # a mapper has few jobs; filtering them here needs no index
+        done = any(job.finished is not None for job in
+                   MapperJob.query(MapperJob.name == name).fetch())
+        memcache.set(key, done, time=0 if done else BACKFILL_CHECK_TTL)
+    return done
+
+
+# backfills
+
+@mapper('session_indexes', Session)
+def reindexSession(session):
+    """Rewrite a Session so its computed type_hour, starts_at and ends_at
+    and its modified stamp are stored."""
+    return session
+
+
+@mapper('conference_month', Conference)
+def recomputeMonth(conf):
+    """Recompute the month a Conference starts in from its startDate."""
+    month = conf.startDate.month if conf.startDate else 0
+    if conf.month != month:
+        conf.month = month
+        return conf
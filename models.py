@@ -12,14 +12,13 @@ created/forked from conferences.py by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
-import httplib
-import endpoints
+import time
+from datetime import datetime
+from datetime import timedelta
 from protorpc import messages
 from google.appengine.ext import ndb
 
-class ConflictException(endpoints.ServiceException):
-    """ConflictException -- exception mapped to HTTP 409 response"""
-    http_status = httplib.CONFLICT
+from geo import geohashPrefixes
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
@@ -28,6 +27,8 @@ class Profile(ndb.Model):
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionKeysInWishlist = ndb.StringProperty(repeated=True)
+    # see wishlist.py for the layout
+    wishlistSchedule = ndb.JsonProperty()
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -50,6 +51,34 @@ class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
 
+class WishlistForm(messages.Message):
+    """WishlistForm -- outbound wishlist update result message"""
+    data = messages.BooleanField(1)
+    conflictingSessionKeys = messages.StringField(2, repeated=True)
+    websafeSessionKey = messages.StringField(3)
+
+class WishlistForms(messages.Message):
+    """WishlistForms -- multiple WishlistForm outbound message"""
+    items = messages.MessageField(WishlistForm, 1, repeated=True)
+
+class WishlistOpForm(messages.Message):
+    """WishlistOpForm -- add or remove one session inbound message"""
+    websafeSessionKey = messages.StringField(1)
+    add = messages.BooleanField(2, default=True)
+
+class WishlistOpForms(messages.Message):
+    """WishlistOpForms -- multiple WishlistOpForm inbound message"""
+    ops = messages.MessageField(WishlistOpForm, 1, repeated=True)
+
+class SessionConflictForm(messages.Message):
+    """SessionConflictForm -- pair of overlapping wishlisted sessions"""
+    websafeSessionKey = messages.StringField(1)
+    conflictingSessionKey = messages.StringField(2)
+
+class SessionConflictForms(messages.Message):
+    """SessionConflictForms -- multiple SessionConflictForm message"""
+    items = messages.MessageField(SessionConflictForm, 1, repeated=True)
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
@@ -62,6 +91,100 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # seats freed by unregistrations, held for the waitlist until the
+    # promotion task has filled or released them
+    heldSeats       = ndb.IntegerProperty(default=0, indexed=False)
+    latitude        = ndb.FloatProperty(indexed=False)
+    longitude       = ndb.FloatProperty(indexed=False)
+    # every prefix of the geohash of latitude/longitude, so the conferences
+    # in a geohash cell of any size are one equality scan
+    geohashes       = ndb.ComputedProperty(
+            lambda self: geohashPrefixes(self.latitude, self.longitude),
+            repeated=True)
+
+# defaults of the Conference fields a request leaves out
+DEFAULTS_CONF = {
+    "city": "Default City",
+    "maxAttendees": 0,
+    "seatsAvailable": 0,
+    "topics": ["Default", "Topic"],
+}
+
+class ImportJob(ndb.Model):
+    """ImportJob -- a bulk Conference import and its progress"""
+    organizerUserId = ndb.StringProperty()
+    organizerEmail  = ndb.StringProperty(indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    totalRows       = ndb.IntegerProperty(indexed=False)
+    chunks          = ndb.IntegerProperty(indexed=False)
+    chunksDone      = ndb.IntegerProperty(default=0, indexed=False)
+    rowsImported    = ndb.IntegerProperty(default=0, indexed=False)
+    rowsFailed      = ndb.IntegerProperty(default=0, indexed=False)
+
+class ImportChunk(ndb.Model):
+    """ImportChunk -- rows of an ImportJob processed by one task; child
+    of the job"""
+    firstRow        = ndb.IntegerProperty(indexed=False)
+    rows            = ndb.JsonProperty(compressed=True)
+    conferenceIds   = ndb.IntegerProperty(repeated=True, indexed=False)
+    errors          = ndb.JsonProperty()
+    done            = ndb.BooleanProperty(default=False)
+
+class MapperJob(ndb.Model):
+    """MapperJob -- a run of a registered mapper over every entity of a
+    kind"""
+    name            = ndb.StringProperty()
+    kind            = ndb.StringProperty()
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+    finished        = ndb.DateTimeProperty()
+    shards          = ndb.IntegerProperty(indexed=False)
+    shardsDone      = ndb.IntegerProperty(default=0, indexed=False)
+
+class MapperShard(ndb.Model):
+    """MapperShard -- one key range of a MapperJob and its checkpoint;
+    child of the job"""
+    startKey        = ndb.KeyProperty(indexed=False)
+    endKey          = ndb.KeyProperty(indexed=False)
+    cursor          = ndb.StringProperty(indexed=False)
+    slice           = ndb.IntegerProperty(default=0, indexed=False)
+    processed       = ndb.IntegerProperty(default=0, indexed=False)
+    written         = ndb.IntegerProperty(default=0, indexed=False)
+    done            = ndb.BooleanProperty(default=False, indexed=False)
+    updated         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- a user queued for a seat at a full Conference;
+    child of the user's Profile, with the websafeConferenceKey as id"""
+    conference      = ndb.StringProperty()
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class BatchRequestForm(messages.Message):
+    """BatchRequestForm -- one call of a batch inbound message"""
+    id              = messages.StringField(1)
+    method          = messages.StringField(2, required=True)
+    params          = messages.StringField(3)   # JSON encoded request
+
+class BatchRequestForms(messages.Message):
+    """BatchRequestForms -- the calls of a batch inbound message"""
+    requests = messages.MessageField(BatchRequestForm, 1, repeated=True)
+
+class BatchResponseForm(messages.Message):
+    """BatchResponseForm -- result of one call of a batch"""
+    id              = messages.StringField(1)
+    method          = messages.StringField(2)
+    result          = messages.StringField(3)   # JSON encoded response
+    error           = messages.StringField(4)
+    code            = messages.IntegerField(5, variant=messages.Variant.INT32)
+
+class BatchResponseForms(messages.Message):
+    """BatchResponseForms -- the results of a batch outbound message"""
+    responses = messages.MessageField(BatchResponseForm, 1, repeated=True)
+
+class WaitlistForm(messages.Message):
+    """WaitlistForm -- outbound waitlist position message"""
+    websafeConferenceKey = messages.StringField(1)
+    position        = messages.IntegerField(2, variant=messages.Variant.INT32)
+    registered      = messages.BooleanField(3)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -77,6 +200,8 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    latitude        = messages.FloatField(13)
+    longitude       = messages.FloatField(14)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
@@ -112,6 +237,7 @@ class ConferenceQueryForms(messages.Message):
         multiple ConferenceQueryForm inbound form message
     """
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    fields = messages.StringField(2, repeated=True)
 
 class Session(ndb.Model):
     """Session -- Session Object"""
@@ -123,6 +249,67 @@ class Session(ndb.Model):
     date            = ndb.DateProperty()
     start_time      = ndb.IntegerProperty()
     conference_id   = ndb.IntegerProperty()
+    modified        = ndb.IntegerProperty()
+    # composite type x start-hour bucket, e.g. 'WORKSHOP:18', so that a
+    # start time window per session type is a single range scan
+    type_hour       = ndb.ComputedProperty(
+            lambda self: typeHourBucket(self.type_of_session, self.start_time))
+    # absolute start and end, so time windows across days and conferences
+    # are a single range scan
+    starts_at       = ndb.ComputedProperty(
+            lambda self: sessionStartsAt(self.date, self.start_time))
+    ends_at         = ndb.ComputedProperty(
+            lambda self: sessionEndsAt(self.date, self.start_time,
+                                       self.duration))
+
+    def _pre_put_hook(self):
+        """Stamp every write so clients can sync by modification time."""
+        self.modified = max(syncTimestamp(), (self.modified or 0) + 1)
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        """Leave a tombstone behind so syncing clients see the delete."""
+        SessionTombstone(id=key.id(), parent=key.parent(),
+                         websafeKey=key.urlsafe(),
+                         modified=syncTimestamp()).put()
+        from schedule import invalidateSchedule
+        invalidateSchedule(key.parent())
+
+class SessionTombstone(ndb.Model):
+    """SessionTombstone -- marker for a deleted Session, kept for syncing"""
+    websafeKey      = ndb.StringProperty(indexed=False)
+    modified        = ndb.IntegerProperty()
+
+class ScheduleSnapshot(ndb.Model):
+    """ScheduleSnapshot -- datastore copy of a conference's schedule"""
+    version         = ndb.IntegerProperty(indexed=False)
+    data            = ndb.JsonProperty(compressed=True)
+
+def typeHourBucket(type_of_session, start_time):
+    """Return the type_hour bucket of a session type and HHMM time."""
+    return '%s:%02d' % (type_of_session or 'NOT_SPECIFIED',
+                        (start_time or 0) // 100)
+
+def sessionStartsAt(date, start_time):
+    """Return the datetime a session on date starting at HHMM begins."""
+    if not date:
+        return None
+    start_time = start_time or 0
+    return datetime(date.year, date.month, date.day) + timedelta(
+            hours=start_time // 100, minutes=start_time % 100)
+
+def sessionEndsAt(date, start_time, duration):
+    """Return the datetime a session ends, given its duration in minutes."""
+    starts_at = sessionStartsAt(date, start_time)
+    if starts_at is None:
+        return None
+    return starts_at + timedelta(minutes=duration or 0)
+
+def syncTimestamp():
+    """Return the current time in microseconds, used to stamp session
+    changes. The stamps are only as ordered as the clocks of the instances
+    taking them; see SYNC_SAFETY_MARGIN in conference.py."""
+    return int(time.time() * 1000000)
 
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
@@ -140,6 +327,25 @@ class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
 
+class SessionSyncForm(messages.Message):
+    """SessionSyncForm -- Session changes since a sync token"""
+    items       = messages.MessageField(SessionForm, 1, repeated=True)
+    deletedKeys = messages.StringField(2, repeated=True)
+    syncToken   = messages.StringField(3)
+    fullSync    = messages.BooleanField(4)  # items replace the client's copy
+
+class SessionSearchForm(messages.Message):
+    """SessionSearchForm -- Session search inbound form message"""
+    startAfter      = messages.IntegerField(1)  # HHMM, inclusive
+    startBefore     = messages.IntegerField(2)  # HHMM, exclusive
+    includeTypes    = messages.EnumField('TypeOfSession', 3, repeated=True)
+    excludeTypes    = messages.EnumField('TypeOfSession', 4, repeated=True)
+    minDuration     = messages.IntegerField(5)
+    maxDuration     = messages.IntegerField(6)
+    startDate       = messages.StringField(7)  # YYYY-MM-DD, inclusive
+    endDate         = messages.StringField(8)  # YYYY-MM-DD, inclusive
+    fields          = messages.StringField(9, repeated=True)
+
 class TypeOfSession(messages.Enum):
     """TypeOfSession -- session enumeration value"""
     NOT_SPECIFIED = 1
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""
+recommendations.py -- precomputed conference recommendations
+
+A cron job scores the conferences that can still be attended, once per user.
+A user's score for a conference is a weighted sum of two similarities, each
+computed from sparse vectors:
+    - topic similarity: cosine between the conference's TF-IDF topic vector
+      and the sum of the vectors of the conferences the user attends
+    - co-attendance: for every conference the user attends, the cosine
+      between the attendee sets of it and the candidate, i.e. "people who
+      registered for this also registered for that"
+Both sides are walked through inverted indexes (topic -> conferences,
+conference -> nearest neighbours), never through every pair. Each user's
+top-N is stored in memcache as encoded ConferenceForms, so the endpoint
+serves it with a single cache read. Users without registrations get the
+most attended conferences instead.
+
+"""
+
+import logging
+import math
+from collections import defaultdict
+from datetime import date
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+from forms import conferenceForm
+from models import Conference
+from models import ConferenceForms
+from models import Profile
+
+MEMCACHE_RECOMMENDED_KEY = "RECOMMENDED:%s"
+POPULAR_USER = '__popular__'
+RECOMMENDATIONS_TTL = 24 * 60 * 60  # the cron refreshes them well before
+TOP_N = 10
+NEIGHBOURS = 20         # co-attended conferences kept per conference
+TOPIC_POSTINGS = 200    # most attended candidates kept per topic
+MAX_USER_CONFS = 50     # registrations per user used for co-attendance
+TOPIC_WEIGHT = 0.4
+COATTENDANCE_WEIGHT = 0.6
+SET_BATCH = 500         # keys per memcache.set_multi call
+
+
+def recommendationKey(user_id):
+    return MEMCACHE_RECOMMENDED_KEY % user_id
+
+
+def _topicVectors(conferences):
+    """Return unit-length TF-IDF topic vectors, keyed by websafe key."""
+    df = defaultdict(int)
+    for conf in conferences:
+        for topic in set(conf.topics):
+            df[topic] += 1
+    n = float(len(conferences))
+    vectors = {}
+    for conf in conferences:
+        vector = dict((topic, math.log(1 + n / df[topic]))
+                      for topic in set(conf.topics))
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        if norm:
+            vectors[conf.key.urlsafe()] = dict(
+                    (topic, w / norm) for topic, w in vector.items())
+    return vectors
+
+
+def _neighbours(attending):
+    """
+        Return the co-attendance cosine neighbours of each conference,
+        {wsck: [(other wsck, similarity)]}, best first.
+    """
+    attendees = defaultdict(int)
+    together = defaultdict(lambda: defaultdict(int))
+    for wscks in attending.values():
+        wscks = sorted(wscks)[:MAX_USER_CONFS]
+        for wsck in wscks:
+            attendees[wsck] += 1
+        for i, a in enumerate(wscks):
+            for b in wscks[i + 1:]:
+                together[a][b] += 1
+                together[b][a] += 1
+    neighbours = {}
+    for a, counts in together.items():
+        scored = [(b, count / math.sqrt(attendees[a] * attendees[b]))
+                  for b, count in counts.items()]
+        scored.sort(key=lambda pair: -pair[1])
+        neighbours[a] = scored[:NEIGHBOURS]
+    return neighbours, attendees
+
+
+def _recommend(wscks, vectors, postings, neighbours, candidates):
+    """Return the top-N candidate wscks for a user attending wscks."""
+    scores = defaultdict(float)
+    profile = defaultdict(float)
+    for wsck in wscks:
+        for topic, w in vectors.get(wsck, {}).items():
+            profile[topic] += w
+        for other, similarity in neighbours.get(wsck, ()):
+            scores[other] += COATTENDANCE_WEIGHT * similarity
+    norm = math.sqrt(sum(w * w for w in profile.values()))
+    for topic, w in profile.items():
+        for other, weight in postings.get(topic, ()):
+            scores[other] += TOPIC_WEIGHT * w / norm * weight
+    ranked = sorted((wsck for wsck in scores
+                     if wsck in candidates and wsck not in wscks),
+                    key=lambda wsck: (-scores[wsck], wsck))
+    return ranked[:TOP_N]
+
+
+def rebuild():
+    """
+        Recompute every user's recommendations and store them in memcache;
+        run by the recommendations cron job.
+
+    :return: the number of users recommendations were stored for
+    """
+    conferences = list(Conference.query().iter(batch_size=500))
+    # one result per registration; profiles without any don't show up
+    attending = defaultdict(set)
+    for prof in Profile.query().iter(
+            projection=[Profile.conferenceKeysToAttend], batch_size=1000):
+        attending[prof.key.id()].add(prof.conferenceKeysToAttend[0])
+
+    today = date.today()
+    by_wsck = dict((conf.key.urlsafe(), conf) for conf in conferences)
+    candidates = set(wsck for wsck, conf in by_wsck.items()
+                     if (conf.seatsAvailable or 0) > 0 and
+                     (not conf.startDate or conf.startDate >= today))
+
+    vectors = _topicVectors(conferences)
+    neighbours, attendees = _neighbours(attending)
+    postings = defaultdict(list)
+    for wsck in candidates:
+        for topic, weight in vectors.get(wsck, {}).items():
+            postings[topic].append((wsck, weight))
+    for topic in postings:
+        postings[topic].sort(key=lambda pair: -attendees.get(pair[0], 0))
+        del postings[topic][TOPIC_POSTINGS:]
+
+    recommended = {POPULAR_USER: sorted(
+            candidates, key=lambda wsck: (-attendees.get(wsck, 0), wsck)
+    )[:TOP_N]}
+    for user_id, wscks in attending.items():
+        recommended[user_id] = _recommend(wscks, vectors, postings,
+                                          neighbours, candidates)
+
+    # organiser display names, for the recommended conferences only
+    shown = set(wsck for wscks in recommended.values() for wsck in wscks)
+    organisers = set(ndb.Key(Profile, by_wsck[wsck].organizerUserId)
+                     for wsck in shown)
+    names = dict((prof.key.id(), prof.displayName)
+                 for prof in ndb.get_multi(list(organisers)) if prof)
+
+    forms = dict((wsck, conferenceForm(
+            by_wsck[wsck], names.get(by_wsck[wsck].organizerUserId)))
+                 for wsck in shown)
+    encoded = dict((recommendationKey(user_id), protojson.encode_message(
+            ConferenceForms(items=[forms[wsck] for wsck in wscks])))
+                   for user_id, wscks in recommended.items())
+
+    keys = list(encoded)
+    for start in range(0, len(keys), SET_BATCH):
+        failed = memcache.set_multi(
+                dict((key, encoded[key])
+                     for key in keys[start:start + SET_BATCH]),
+                time=RECOMMENDATIONS_TTL)
+        if failed:
+            logging.warning('Could not cache %d recommendation lists',
+                            len(failed))
+    return len(recommended) - 1
+
+
+def getRecommended(user_id):
+    """
+        Return the cached recommendations of a user as ConferenceForms,
+        falling back to the popular ones, in one memcache call.
+    """
+    key = recommendationKey(user_id)
+    cached = memcache.get_multi([key, recommendationKey(POPULAR_USER)])
+    data = cached.get(key) or cached.get(recommendationKey(POPULAR_USER))
+    if not data:
+        return ConferenceForms()
+    return protojson.decode_message(ConferenceForms, data)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""
+schedule.py -- precomputed per-conference session schedules
+
+A conference's sessions are kept as one compact, column-oriented snapshot,
+pre-sorted by date and start_time, so the session browsing endpoints can be
+answered in memory instead of running an ancestor query each.
+
+"""
+
+from bisect import bisect_left
+from bisect import bisect_right
+from datetime import datetime
+
+from google.appengine.ext import ndb
+
+from models import ScheduleSnapshot
+from models import Session
+import cache
+
+MEMCACHE_SCHEDULE_KEY = "SCHEDULE:%s"
+SCHEDULE_TTL = 10 * 60
+SNAPSHOT_ID = 'schedule'
+
+# the SessionForm fields stored per session, in column order
+COLUMNS = ('websafeKey', 'name', 'highlights', 'speaker', 'duration',
+           'type_of_session', 'date', 'start_time', 'conference_id')
+
+
+class ScheduledSession(object):
+    """A read-only session row of a ConferenceSchedule."""
+    __slots__ = COLUMNS
+
+    def __init__(self, values):
+        for column, value in zip(COLUMNS, values):
+            setattr(self, column, value)
+
+
+class ConferenceSchedule(object):
+    """
+        All the sessions of a conference ordered by date and start_time,
+        stored as parallel arrays with a duration index next to them.
+    """
+
+    def __init__(self, columns, version=0):
+        self.columns = columns
+        self.version = version
+        # sort key per row: days since epoch * 10000 + HHMM
+        self.times = [self._timeKey(d, t) for d, t in
+                      zip(columns['date'], columns['start_time'])]
+        # row positions ordered by duration, for binary search
+        durations = columns['duration']
+        self.byDuration = sorted(range(len(durations)),
+                                 key=lambda i: durations[i] or 0)
+        self.durations = [durations[i] or 0 for i in self.byDuration]
+
+    def __len__(self):
+        return len(self.times)
+
+    @staticmethod
+    def _timeKey(date, start_time):
+        """Return the sort key of a 'YYYY-MM-DD' date and HHMM time."""
+        days = 0
+        if date and date != 'None':
+            days = datetime.strptime(date, "%Y-%m-%d").toordinal()
+        return days * 10000 + (start_time or 0)
+
+    @classmethod
+    def fromSessions(cls, sessions):
+        """Build a schedule from Session entities."""
+        columns = dict((column, []) for column in COLUMNS)
+        version = 0
+        for session in sorted(sessions,
+                              key=lambda s: s.starts_at or datetime.min):
+            columns['websafeKey'].append(session.key.urlsafe())
+            columns['date'].append(str(session.date))
+            for column in COLUMNS[1:]:
+                if column != 'date':
+                    columns[column].append(getattr(session, column))
+            version = max(version, session.modified or 0)
+        return cls(columns, version)
+
+    def encode(self):
+        """Return the snapshot as a JSON/pickle friendly dict."""
+        return {'version': self.version, 'columns': self.columns}
+
+    @classmethod
+    def decode(cls, data):
+        """Inverse of encode()."""
+        return cls(data['columns'], data.get('version', 0))
+
+    def row(self, i):
+        """Return the i-th session of the schedule."""
+        return ScheduledSession([self.columns[c][i] for c in COLUMNS])
+
+    def sessions(self):
+        """Return every session, in schedule order."""
+        return [self.row(i) for i in range(len(self))]
+
+    def ofType(self, typeOfSession):
+        """Return the sessions of the given type, in schedule order."""
+        types = self.columns['type_of_session']
+        return [self.row(i) for i in range(len(self))
+                if types[i] == typeOfSession]
+
+    def withDuration(self, minDuration=None, maxDuration=None):
+        """Return the sessions lasting [minDuration, maxDuration] minutes,
+        shortest first."""
+        lo = 0
+        hi = len(self.durations)
+        if minDuration is not None:
+            lo = bisect_left(self.durations, minDuration)
+        if maxDuration is not None:
+            hi = bisect_right(self.durations, maxDuration)
+        return [self.row(i) for i in self.byDuration[lo:hi]]
+
+    def withKeys(self, websafeKeys):
+        """Return the sessions whose websafe keys are given, in schedule
+        order."""
+        wanted = set(websafeKeys)
+        keys = self.columns['websafeKey']
+        return [self.row(i) for i in range(len(self)) if keys[i] in wanted]
+
+
+def _snapshotKey(conf_key):
+    return ndb.Key(ScheduleSnapshot, SNAPSHOT_ID, parent=conf_key)
+
+
+@ndb.transactional()
+def _storeSnapshot(conf_key, schedule):
+    """Write the snapshot unless a newer one has been stored meanwhile."""
+    snapshot = _snapshotKey(conf_key).get()
+    if snapshot and snapshot.version > schedule.version:
+        return False
+    ScheduleSnapshot(key=_snapshotKey(conf_key), version=schedule.version,
+                     data=schedule.encode()).put()
+    return True
+
+
+def rebuildSchedule(conf_key):
+    """
+        Rebuild the schedule snapshot of a conference from its sessions and
+        store it in the cache and the datastore.
+
+    :param conf_key: ndb.Key of the Conference
+    :return: the rebuilt ConferenceSchedule
+    """
+    # ancestor queries are strongly consistent, so the session that was
+    # just written is part of the snapshot
+    schedule = ConferenceSchedule.fromSessions(
+            Session.query(ancestor=conf_key).fetch())
+    if _storeSnapshot(conf_key, schedule):
+        cache.put(MEMCACHE_SCHEDULE_KEY % conf_key.urlsafe(), schedule,
+                  SCHEDULE_TTL)
+    return schedule
+
+
+def _loadSchedule(conf_key):
+    """Load the datastore snapshot of a schedule, rebuilding it if needed."""
+    snapshot = _snapshotKey(conf_key).get()
+    if snapshot:
+        return ConferenceSchedule.decode(snapshot.data)
+    return rebuildSchedule(conf_key)
+
+
+def getSchedule(conf_key):
+    """
+        Return the schedule of a conference from the cache, falling back to
+        the datastore snapshot and finally to rebuilding it. Only one
+        request at a time loads a missing schedule.
+
+    :param conf_key: ndb.Key of the Conference
+    :return: ConferenceSchedule
+    """
+    return cache.getOrCompute(MEMCACHE_SCHEDULE_KEY % conf_key.urlsafe(),
+                              lambda: _loadSchedule(conf_key), SCHEDULE_TTL)
+
+
+def invalidateSchedule(conf_key):
+    """Drop the stored schedule so the next read rebuilds it."""
+    cache.invalidate(MEMCACHE_SCHEDULE_KEY % conf_key.urlsafe())
+    _snapshotKey(conf_key).delete()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+"""
+seatpush.py -- pushes seatsAvailable changes to the conference pages
+
+Instead of refetching a conference to see its seat count, a page long-polls
+/push/seats with the version of the count it has, and the request returns
+as soon as a newer count is published (or empty after POLL_SECONDS). Only
+the changed count travels, not the ConferenceForm.
+
+Registrations call publish() once their transaction has committed.
+Publishing is coalesced per conference: the first change after a quiet
+period schedules a flush COALESCE_SECONDS later, changes until then only
+ride along, and the flush reads the current count once and publishes it
+under a new version. The flush releases the schedule before it reads, so
+a change made during the flush schedules the next one. A hot conference
+therefore sends at most about one update per interval, and the last change
+is never lost.
+
+A waiting poll checks memcache with a growing interval, up to
+MAX_POLL_INTERVAL, so an open page costs a few memcache reads per
+POLL_SECONDS rather than one per half second. It does hold a request
+thread meanwhile, which is why the page stops polling when it is left.
+
+The Broker below keeps the published counts in memcache and flushes from a
+task; LocalBroker keeps them in the process and flushes on demand, as a
+stand-in for tests (see setBroker()).
+
+"""
+
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+PUBLISH_URL = '/tasks/publish_seats'
+MEMCACHE_SEATS_KEY = "SEATS:%s"
+MEMCACHE_SCHEDULED_KEY = "SEATS_SCHEDULED:%s"
+COALESCE_SECONDS = 2    # at most one update per conference this often
+POLL_SECONDS = 25       # a long-poll returns empty after this long
+POLL_INTERVAL = 1       # first wait between memcache checks while polling
+MAX_POLL_INTERVAL = 5   # the wait doubles up to this
+SEATS_TTL = 60 * 60
+
+
+def loadSeats(wsck):
+    """Return the current seatsAvailable of a conference, or None."""
+    conf = ndb.Key(urlsafe=wsck).get()
+    return conf.seatsAvailable if conf else None
+
+
+class Broker(object):
+    """Publishes seat counts through memcache; flushes run as tasks."""
+
+    def __init__(self, load=None):
+        self.load = load or loadSeats
+
+    def publish(self, wsck):
+        """Note that the seats of a conference changed."""
+        if self._claim(wsck):
+            self._schedule(wsck)
+
+    def flush(self, wsck):
+        """
+            Publish the current count of a conference under a new version.
+
+        :return: the update published, or None for a missing conference
+        """
+        # before reading, so a change from now on schedules another flush
+        self._release(wsck)
+        seats = self.load(wsck)
+        if seats is None:
+            return None
+        return self._store(wsck, seats)
+
+    def poll(self, wsck, version, timeout=POLL_SECONDS):
+        """
+            Wait for an update newer than version.
+
+        :param wsck: websafeConferenceKey of the conference
+        :param version: the version the client has, 0 for none
+        :param timeout: seconds to wait at most
+        :return: {'version', 'seatsAvailable'}, or None on timeout
+        """
+        deadline = time.time() + timeout
+        interval = POLL_INTERVAL
+        while True:
+            update = self._load(wsck)
+            if update and update['version'] > version:
+                return update
+            if time.time() >= deadline:
+                return None
+            self._wait(wsck, min(interval, deadline - time.time()))
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    @staticmethod
+    def _nextVersion(previous):
+        # time based, so versions keep growing if memcache drops the count
+        return max((previous['version'] if previous else 0) + 1,
+                   int(time.time() * 1000))
+
+    def _claim(self, wsck):
+        # only the first change of an interval gets to schedule the flush
+        return memcache.add(MEMCACHE_SCHEDULED_KEY % wsck, 1,
+                            time=COALESCE_SECONDS)
+
+    def _release(self, wsck):
+        memcache.delete(MEMCACHE_SCHEDULED_KEY % wsck)
+
+    def _schedule(self, wsck):
+        taskqueue.add(params={'wsck': wsck}, url=PUBLISH_URL,
+                      countdown=COALESCE_SECONDS)
+
+    def _store(self, wsck, seats):
+        update = {'version': self._nextVersion(self._load(wsck)),
+                  'seatsAvailable': seats}
+        memcache.set(MEMCACHE_SEATS_KEY % wsck, update, time=SEATS_TTL)
+        return update
+
+    def _load(self, wsck):
+        return memcache.get(MEMCACHE_SEATS_KEY % wsck)
+
+    def _wait(self, wsck, seconds):
+        time.sleep(max(seconds, 0))
+
+
+class LocalBroker(Broker):
+    """
+        In-process broker for tests: scheduled flushes are collected until
+        flushPending() runs them, and polls wake up as soon as a count is
+        published.
+    """
+
+    def __init__(self, load=None):
+        super(LocalBroker, self).__init__(load)
+        self.updates = {}
+        self.scheduled = set()
+        self._changed = threading.Condition()
+
+    def flushPending(self):
+        """Run the scheduled flushes, as the tasks would."""
+        return [self.flush(wsck) for wsck in sorted(self.scheduled)]
+
+    def _claim(self, wsck):
+        return wsck not in self.scheduled
+
+    def _release(self, wsck):
+        self.scheduled.discard(wsck)
+
+    def _schedule(self, wsck):
+        self.scheduled.add(wsck)
+
+    def _store(self, wsck, seats):
+        with self._changed:
+            update = {'version': self._nextVersion(self.updates.get(wsck)),
+                      'seatsAvailable': seats}
+            self.updates[wsck] = update
+            self._changed.notify_all()
+        return update
+
+    def _load(self, wsck):
+        return self.updates.get(wsck)
+
+    def _wait(self, wsck, seconds):
+        with self._changed:
+            self._changed.wait(max(seconds, 0))
+
+
+broker = Broker()
+
+
+def setBroker(new):
+    """Replace the broker, e.g. by a LocalBroker in tests; returns the old."""
+    global broker
+    old, broker = broker, new
+    return old
+
+
+def publish(wsck):
+    broker.publish(wsck)
+
+
+def flush(wsck):
+    return broker.flush(wsck)
+
+
+def poll(wsck, version, timeout=POLL_SECONDS):
+    return broker.poll(wsck, version, timeout)
@@ -76,6 +76,19 @@ app.constant('HTTP_ERRORS', {
 });
 
 
+/**
+ * @ngdoc constant
+ * @name CONFERENCE_LIST_FIELDS
+ *
+ * @description
+ * The ConferenceForm fields rendered by the conference list, sent as a field mask so the server
+ * only loads and returns these.
+ *
+ */
+app.constant('CONFERENCE_LIST_FIELDS', ['websafeKey', 'name', 'city', 'startDate',
+    'organizerDisplayName', 'maxAttendees', 'seatsAvailable']);
+
+
 /**
  * @ngdoc service
  * @name oauth2Provider
@@ -84,7 +97,7 @@ app.constant('HTTP_ERRORS', {
  * Service that holds the OAuth2 information shared across all the pages.
  *
  */
-app.factory('oauth2Provider', function ($modal) {
+app.factory('oauth2Provider', function ($modal, apiCache) {
     var oauth2Provider = {
         CLIENT_ID: '608741245279-ql8a7a5juad6r9aqsm8mk62chgkr8vur.apps.googleusercontent.com',
         SCOPES: 'email profile',
@@ -105,6 +118,20 @@ app.factory('oauth2Provider', function ($modal) {
         });
     };
 
+    /**
+     * Looks up who the current token belongs to and keys the API cache by that user. Called
+     * whenever a token is obtained, so a different account never sees cached responses of the
+     * previous one.
+     *
+     * @param callback called with the userinfo response
+     */
+    oauth2Provider.identify = function (callback) {
+        gapi.client.oauth2.userinfo.get().execute(function (resp) {
+            apiCache.setUser(resp.email || '');
+            callback(resp);
+        });
+    };
+
     /**
      * Logs out the user.
      */
@@ -113,6 +140,7 @@ app.factory('oauth2Provider', function ($modal) {
         // Explicitly set the invalid access token in order to make the API calls fail.
         gapi.auth.setToken({access_token: ''})
         oauth2Provider.signedIn = false;
+        apiCache.setUser('');
     };
 
     /**
@@ -130,3 +158,425 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+/**
+ * @ngdoc service
+ * @name seatPush
+ *
+ * @description
+ * Service that long-polls /push/seats for the seat count of a conference, so the detail page
+ * shows registrations as they happen without refetching the conference. The server holds each
+ * request until the count changes, and sends only the new count.
+ *
+ */
+app.factory('seatPush', function ($http, $q, $timeout) {
+    var seatPush = {
+        RETRY_MS: 5000
+    };
+
+    /**
+     * Calls callback with every {version, seatsAvailable} update of a conference.
+     *
+     * @param websafeConferenceKey
+     * @param callback
+     * @returns {Function} that stops the subscription
+     */
+    seatPush.subscribe = function (websafeConferenceKey, callback) {
+        var version = 0;
+        var stopped = false;
+        var aborter = null;
+        var retry = null;
+
+        var poll = function () {
+            if (stopped) {
+                return;
+            }
+            aborter = $q.defer();
+            $http.get('/push/seats', {
+                params: {wsck: websafeConferenceKey, version: version},
+                timeout: aborter.promise
+            }).then(function (resp) {
+                // 204 means nothing changed before the server gave up waiting
+                if (resp.status == 200 && resp.data.version > version) {
+                    version = resp.data.version;
+                    callback(resp.data);
+                }
+                poll();
+            }, function () {
+                if (!stopped) {
+                    retry = $timeout(poll, seatPush.RETRY_MS);
+                }
+            });
+        };
+        poll();
+
+        return function () {
+            stopped = true;
+            $timeout.cancel(retry);
+            if (aborter) {
+                // resolving the timeout promise aborts the pending request
+                aborter.resolve();
+            }
+        };
+    };
+
+    return seatPush;
+});
+
+/**
+ * @ngdoc service
+ * @name apiCache
+ *
+ * @description
+ * Stale-while-revalidate cache for the read-only conference API methods. A cached response is
+ * served right away, from memory or IndexedDB, and the method is called again in the background;
+ * the callback runs a second time only if the fresh response differs. Concurrent calls with the
+ * same parameters share one request. Mutating methods drop the responses they may have changed.
+ * Responses are kept per signed-in user; switching users drops the others' responses.
+ *
+ */
+app.factory('apiCache', function () {
+    var apiCache = {
+        /**
+         * Responses younger than this are served without revalidating.
+         */
+        FRESH_MS: 5000,
+        MAX_ENTRIES: 200,
+        DB_NAME: 'conferenceApiCache',
+        STORE: 'responses'
+    };
+
+    /**
+     * The read methods each mutating method may change.
+     */
+    var INVALIDATES = {
+        saveProfile: ['getProfile'],
+        createConference: ['queryConferences', 'getUpcomingConferences', 'getConferencesCreated'],
+        registerForConference: ['getProfile', 'getConference', 'getConferencesToAttend', 'queryConferences',
+            'getUpcomingConferences'],
+        unregisterFromConference: ['getProfile', 'getConference', 'getConferencesToAttend', 'queryConferences',
+            'getUpcomingConferences'],
+        joinConferenceWaitlist: ['getConference']
+    };
+
+    /**
+     * The cached entries by key, each {key, method, resp, time}.
+     * @type {{}}
+     */
+    var memory = {};
+    var memoryKeys = [];
+
+    /**
+     * The email of the signed-in user, '' when nobody is; it prefixes every key.
+     * @type {string}
+     */
+    var user = '';
+
+    var keyFor = function (method, params) {
+        return user + '|' + method + ':' + angular.toJson(params);
+    };
+
+    /**
+     * The callbacks waiting on each in-flight request, by key.
+     * @type {{}}
+     */
+    var inFlight = {};
+
+    var dbState = null;
+    var openDb = function (callback) {
+        if (!window.indexedDB) {
+            callback(null);
+            return;
+        }
+        if (!dbState) {
+            dbState = {db: null, waiting: [callback], done: false};
+            var state = dbState;
+            var finish = function (db) {
+                state.db = db;
+                state.done = true;
+                angular.forEach(state.waiting, function (waiting) {
+                    waiting(db);
+                });
+            };
+            try {
+                var request = window.indexedDB.open(apiCache.DB_NAME, 1);
+                request.onupgradeneeded = function () {
+                    request.result.createObjectStore(apiCache.STORE, {keyPath: 'key'});
+                };
+                request.onsuccess = function () {
+                    finish(request.result);
+                };
+                request.onerror = function () {
+                    finish(null);
+                };
+            } catch (e) {
+                finish(null);
+            }
+        } else if (dbState.done) {
+            callback(dbState.db);
+        } else {
+            dbState.waiting.push(callback);
+        }
+    };
+
+    var withStore = function (mode, callback) {
+        openDb(function (db) {
+            if (!db) {
+                return;
+            }
+            try {
+                callback(db.transaction(apiCache.STORE, mode).objectStore(apiCache.STORE));
+            } catch (e) {
+                // the store is unusable (e.g. private browsing); memory still works
+            }
+        });
+    };
+
+    /**
+     * Reads an entry from IndexedDB; callback gets null if there is none or the store is unusable.
+     */
+    var lookup = function (key, callback) {
+        openDb(function (db) {
+            if (!db) {
+                callback(null);
+                return;
+            }
+            try {
+                var request = db.transaction(apiCache.STORE, 'readonly').objectStore(apiCache.STORE).get(key);
+                request.onsuccess = function () {
+                    callback(request.result || null);
+                };
+                request.onerror = function () {
+                    callback(null);
+                };
+            } catch (e) {
+                callback(null);
+            }
+        });
+    };
+
+    var remember = function (entry) {
+        if (!memory[entry.key]) {
+            memoryKeys.push(entry.key);
+            if (memoryKeys.length > apiCache.MAX_ENTRIES) {
+                delete memory[memoryKeys.shift()];
+            }
+        }
+        memory[entry.key] = entry;
+    };
+
+    var deliver = function (callback, resp) {
+        // always asynchronous, like gapi, so callers can $scope.$apply
+        window.setTimeout(function () {
+            callback(angular.copy(resp));
+        }, 0);
+    };
+
+    var revalidate = function (method, params, key, cached, callback) {
+        if (inFlight[key]) {
+            inFlight[key].push({callback: callback, cached: cached});
+            return;
+        }
+        inFlight[key] = [{callback: callback, cached: cached}];
+        var requestUser = user;
+        gapi.client.conference[method](params).execute(function (resp) {
+            var waiting = inFlight[key];
+            delete inFlight[key];
+            // a response requested before the user changed is not cached for anyone
+            if (!resp.error && requestUser === user) {
+                var entry = {key: key, user: user, method: method, resp: resp, time: Date.now()};
+                remember(entry);
+                withStore('readwrite', function (store) {
+                    store.put(entry);
+                });
+            }
+            angular.forEach(waiting, function (waiter) {
+                var unchanged = waiter.cached && !resp.error &&
+                    angular.equals(waiter.cached.resp, resp);
+                // a failed revalidation of a served response only matters if it needs a login
+                var ignorable = waiter.cached && resp.error && resp.code != 401;
+                if (!unchanged && !ignorable) {
+                    waiter.callback(resp);
+                }
+            });
+        });
+    };
+
+    /**
+     * Calls a read-only conference API method through the cache.
+     *
+     * @param method the name of the gapi.client.conference method
+     * @param params its parameters
+     * @param callback called with the response, like execute(); it is called again if a cached
+     *        response is revalidated and has changed
+     */
+    apiCache.call = function (method, params, callback) {
+        params = params || {};
+        var key = keyFor(method, params);
+        var cached = memory[key];
+        if (cached) {
+            deliver(callback, cached.resp);
+            if (Date.now() - cached.time >= apiCache.FRESH_MS) {
+                revalidate(method, params, key, cached, callback);
+            }
+            return;
+        }
+        lookup(key, function (entry) {
+            if (entry) {
+                remember(entry);
+                deliver(callback, entry.resp);
+            }
+            revalidate(method, params, key, entry, callback);
+        });
+    };
+
+    /**
+     * Fetches several read-only methods with a single conference.batch request and caches their
+     * responses. apiCache.call()s made for the same methods and parameters meanwhile wait for the
+     * batch instead of making their own requests. Calls whose response is cached and fresh are
+     * left out.
+     *
+     * @param calls [{method: name, params: {}}]
+     */
+    apiCache.prefetch = function (calls) {
+        var requests = [];
+        var batched = {};
+        angular.forEach(calls, function (call) {
+            var params = call.params || {};
+            var key = keyFor(call.method, params);
+            var cached = memory[key];
+            if (inFlight[key] || batched[key] ||
+                (cached && Date.now() - cached.time < apiCache.FRESH_MS)) {
+                return;
+            }
+            batched[key] = {method: call.method, params: params};
+            inFlight[key] = [];
+            requests.push({id: key, method: call.method, params: angular.toJson(params)});
+        });
+        if (!requests.length) {
+            return;
+        }
+        var requestUser = user;
+        gapi.client.conference.batch({requests: requests}).execute(function (resp) {
+            var results = {};
+            angular.forEach((!resp.error && resp.responses) || [], function (response) {
+                results[response.id] = response;
+            });
+            angular.forEach(batched, function (call, key) {
+                var waiting = inFlight[key];
+                delete inFlight[key];
+                var response = results[key];
+                if (!response || response.error) {
+                    // let each waiting call make its own request and see its own error
+                    angular.forEach(waiting, function (waiter) {
+                        revalidate(call.method, call.params, key, waiter.cached, waiter.callback);
+                    });
+                    return;
+                }
+                var result = angular.fromJson(response.result || '{}');
+                // shaped like a gapi response: the fields, plus a result property holding them
+                var fresh = angular.extend({result: angular.copy(result)}, result);
+                if (requestUser === user) {
+                    var entry = {key: key, user: user, method: call.method, resp: fresh, time: Date.now()};
+                    remember(entry);
+                    withStore('readwrite', function (store) {
+                        store.put(entry);
+                    });
+                }
+                angular.forEach(waiting, function (waiter) {
+                    if (!waiter.cached || !angular.equals(waiter.cached.resp, fresh)) {
+                        waiter.callback(angular.copy(fresh));
+                    }
+                });
+            });
+        });
+    };
+
+    /**
+     * Drops the cached responses of the given read methods.
+     *
+     * @param methods names of gapi.client.conference methods
+     */
+    apiCache.invalidate = function (methods) {
+        angular.forEach(memoryKeys.slice(), function (key) {
+            if (methods.indexOf(memory[key].method) >= 0) {
+                delete memory[key];
+                memoryKeys.splice(memoryKeys.indexOf(key), 1);
+            }
+        });
+        withStore('readwrite', function (store) {
+            store.openCursor().onsuccess = function (event) {
+                var cursor = event.target.result;
+                if (cursor) {
+                    if (methods.indexOf(cursor.value.method) >= 0) {
+                        cursor['delete']();
+                    }
+                    cursor['continue']();
+                }
+            };
+        });
+    };
+
+    /**
+     * Drops the cached responses a successful call of a mutating method may have changed.
+     *
+     * @param method the name of the mutating gapi.client.conference method
+     */
+    apiCache.invalidateAfter = function (method) {
+        apiCache.invalidate(INVALIDATES[method] || []);
+    };
+
+    /**
+     * Sets the signed-in user, '' for nobody. When it changes, the responses cached for anybody
+     * else are dropped, from memory and IndexedDB.
+     *
+     * @param email the email of the user
+     */
+    apiCache.setUser = function (email) {
+        email = email || '';
+        if (email === user) {
+            return;
+        }
+        user = email;
+        memory = {};
+        memoryKeys = [];
+        withStore('readwrite', function (store) {
+            store.openCursor().onsuccess = function (event) {
+                var cursor = event.target.result;
+                if (cursor) {
+                    if (cursor.value.user !== user) {
+                        cursor['delete']();
+                    }
+                    cursor['continue']();
+                }
+            };
+        });
+    };
+
+    /**
+     * Drops every cached response, e.g. when the user signs out.
+     */
+    apiCache.clear = function () {
+        memory = {};
+        memoryKeys = [];
+        withStore('readwrite', function (store) {
+            store.clear();
+        });
+    };
+
+    return apiCache;
+});
+
+/**
+ * Fetches what the first views need with one batch request. The app is bootstrapped once the API client
+ * is loaded, see init() in index.html.
+ */
+app.run(function (apiCache) {
+    var calls = [
+        {method: 'getUpcomingConferences', params: {}}
+    ];
+    if (gapi.auth.getToken() && gapi.auth.getToken().access_token) {
+        calls.push({method: 'getProfile'});
+    }
+    apiCache.prefetch(calls);
+});
@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, HTTP_ERRORS, apiCache) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,21 +63,19 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
-                    execute(function (resp) {
-                        $scope.$apply(function () {
-                            $scope.loading = false;
-                            if (resp.error) {
-                                // Failed to get a user profile.
-                            } else {
-                                // Succeeded to get the user profile.
-                                $scope.profile.displayName = resp.result.displayName;
-                                $scope.profile.teeShirtSize = resp.result.teeShirtSize;
-                                $scope.initialProfile = resp.result;
-                            }
-                        });
-                    }
-                );
+                apiCache.call('getProfile', {}, function (resp) {
+                    $scope.$apply(function () {
+                        $scope.loading = false;
+                        if (resp.error) {
+                            // Failed to get a user profile.
+                        } else {
+                            // Succeeded to get the user profile.
+                            $scope.profile.displayName = resp.result.displayName;
+                            $scope.profile.teeShirtSize = resp.result.teeShirtSize;
+                            $scope.initialProfile = resp.result;
+                        }
+                    });
+                });
             };
             if (!oauth2Provider.signedIn) {
                 var modalInstance = oauth2Provider.showLoginModal();
@@ -111,6 +109,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
                             }
                         } else {
                             // The request has succeeded.
+                            apiCache.invalidateAfter('saveProfile');
                             $scope.messages = 'The profile has been updated';
                             $scope.alertStatus = 'success';
                             $scope.submitted = false;
@@ -135,7 +134,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
  * A controller used for the Create conferences page.
  */
 conferenceApp.controllers.controller('CreateConferenceCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, HTTP_ERRORS, apiCache) {
 
         /**
          * The conference object being edited in the page.
@@ -231,6 +230,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
                             }
                         } else {
                             // The request has succeeded.
+                            apiCache.invalidateAfter('createConference');
                             $scope.messages = 'The conference has been created : ' + resp.result.name;
                             $scope.alertStatus = 'success';
                             $scope.submitted = false;
@@ -249,7 +249,8 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS, apiCache,
+                                                                     CONFERENCE_LIST_FIELDS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -270,6 +271,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         {enumValue: 'CITY', displayName: 'City'},
         {enumValue: 'TOPIC', displayName: 'Topic'},
         {enumValue: 'MONTH', displayName: 'Start month'},
+        {enumValue: 'START_DATE', displayName: 'Start date (YYYY-MM-DD)'},
+        {enumValue: 'END_DATE', displayName: 'End date (YYYY-MM-DD)'},
         {enumValue: 'MAX_ATTENDEES', displayName: 'Max Attendees'}
     ]
 
@@ -408,6 +411,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * The ConferenceForm fields rendered by the conference list, sent as a field mask
+     * so the server only loads and returns these.
+     * @type {string[]}
+     */
+    $scope.listFields = CONFERENCE_LIST_FIELDS;
+
     /**
      * Query the conferences depending on the tab currently selected.
      *
@@ -424,11 +434,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Invokes the conference.queryConferences API, or without filters the cached
+     * conference.getUpcomingConferences list.
      */
     $scope.queryConferencesAll = function () {
         var sendFilters = {
-            filters: []
+            filters: [],
+            fields: $scope.listFields
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -440,32 +452,36 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                 });
             }
         }
+        var method = 'queryConferences';
+        if (!sendFilters.filters.length) {
+            method = 'getUpcomingConferences';
+            sendFilters = {};
+        }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    $scope.loading = false;
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query conferences : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
-                    } else {
-                        // The request has succeeded.
-                        $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
+        apiCache.call(method, sendFilters, function (resp) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (resp.error) {
+                    // The request has failed.
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to query conferences : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
+                } else {
+                    // The request has succeeded.
+                    $scope.submitted = false;
+                    $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
+                    $scope.alertStatus = 'success';
+                    $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
-                    }
-                    $scope.submitted = true;
-                });
+                    $scope.conferences = [];
+                    angular.forEach(resp.items, function (conference) {
+                        $scope.conferences.push(conference);
+                    });
+                }
+                $scope.submitted = true;
             });
+        });
     }
 
     /**
@@ -473,36 +489,35 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    $scope.loading = false;
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query the conferences created : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages);
-
-                        if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
-                            oauth2Provider.showLoginModal();
-                            return;
-                        }
-                    } else {
-                        // The request has succeeded.
-                        $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : Conferences you have created';
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
+        apiCache.call('getConferencesCreated', {}, function (resp) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (resp.error) {
+                    // The request has failed.
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to query the conferences created : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
+                    if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                        oauth2Provider.showLoginModal();
+                        return;
                     }
-                    $scope.submitted = true;
-                });
+                } else {
+                    // The request has succeeded.
+                    $scope.submitted = false;
+                    $scope.messages = 'Query succeeded : Conferences you have created';
+                    $scope.alertStatus = 'success';
+                    $log.info($scope.messages);
+
+                    $scope.conferences = [];
+                    angular.forEach(resp.items, function (conference) {
+                        $scope.conferences.push(conference);
+                    });
+                }
+                $scope.submitted = true;
             });
+        });
     };
 
     /**
@@ -511,31 +526,30 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
-            execute(function (resp) {
-                $scope.$apply(function () {
-                    if (resp.error) {
-                        // The request has failed.
-                        var errorMessage = resp.error.message || '';
-                        $scope.messages = 'Failed to query the conferences to attend : ' + errorMessage;
-                        $scope.alertStatus = 'warning';
-                        $log.error($scope.messages);
+        apiCache.call('getConferencesToAttend', {}, function (resp) {
+            $scope.$apply(function () {
+                if (resp.error) {
+                    // The request has failed.
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to query the conferences to attend : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages);
 
-                        if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
-                            oauth2Provider.showLoginModal();
-                            return;
-                        }
-                    } else {
-                        // The request has succeeded.
-                        $scope.conferences = resp.result.items;
-                        $scope.loading = false;
-                        $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
+                    if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                        oauth2Provider.showLoginModal();
+                        return;
                     }
-                    $scope.submitted = true;
-                });
+                } else {
+                    // The request has succeeded.
+                    $scope.conferences = resp.result.items;
+                    $scope.loading = false;
+                    $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
+                    $scope.alertStatus = 'success';
+                    $log.info($scope.messages);
+                }
+                $scope.submitted = true;
             });
+        });
     };
 });
 
@@ -547,9 +561,20 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, oauth2Provider,
+                                                                      HTTP_ERRORS, apiCache, seatPush) {
     $scope.conference = {};
 
+    /**
+     * Keeps seatsAvailable up to date while the page is shown.
+     */
+    var pushedSeats = null;
+    var unsubscribe = seatPush.subscribe($routeParams.websafeConferenceKey, function (update) {
+        pushedSeats = update.seatsAvailable;
+        $scope.conference.seatsAvailable = update.seatsAvailable;
+    });
+    $scope.$on('$destroy', unsubscribe);
+
     $scope.isUserAttending = false;
 
     /**
@@ -558,10 +583,16 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      *
      */
     $scope.init = function () {
+        // one round trip for both calls below
+        apiCache.prefetch([
+            {method: 'getConference', params: {websafeConferenceKey: $routeParams.websafeConferenceKey}},
+            {method: 'getProfile'}
+        ]);
+
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        apiCache.call('getConference', {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -575,13 +606,17 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                     // The request has succeeded.
                     $scope.alertStatus = 'success';
                     $scope.conference = resp.result;
+                    if (pushedSeats !== null) {
+                        // a (cached) response may be older than the last push
+                        $scope.conference.seatsAvailable = pushedSeats;
+                    }
                 }
             });
         });
 
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
+        apiCache.call('getProfile', {}, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -602,14 +637,47 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
     };
 
 
+    /**
+     * The number of times a registration request is retried after a network or server error.
+     * @type {number}
+     */
+    var REGISTRATION_RETRIES = 2;
+
+    /**
+     * Calls a registration method, retrying on network and server errors. Every attempt carries
+     * the same idempotency key, so the server runs the registration once and replays its result.
+     *
+     * Drops the cached responses the call changed once it succeeds.
+     *
+     * @param method the name of the gapi.client.conference method to call
+     * @param callback called with the final response
+     */
+    var executeRegistration = function (method, callback) {
+        var params = {
+            websafeConferenceKey: $routeParams.websafeConferenceKey,
+            idempotencyKey: Date.now().toString(36) + Math.random().toString(36).substring(2)
+        };
+        var attempt = function (retriesLeft) {
+            gapi.client.conference[method](params).execute(function (resp) {
+                if (resp.error && retriesLeft > 0 && (!resp.code || resp.code >= 500)) {
+                    attempt(retriesLeft - 1);
+                } else {
+                    if (!resp.error) {
+                        apiCache.invalidateAfter(method);
+                    }
+                    callback(resp);
+                }
+            });
+        };
+        attempt(REGISTRATION_RETRIES);
+    };
+
     /**
      * Invokes the conference.registerForConference method.
      */
     $scope.registerForConference = function () {
         $scope.loading = true;
-        gapi.client.conference.registerForConference({
-            websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        executeRegistration('registerForConference', function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -640,13 +708,44 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
     };
 
     /**
-     * Invokes the conference.unregisterForConference method.
+     * Invokes the conference.joinConferenceWaitlist method. Waitlisted users are registered by
+     * the server as seats free up.
      */
-    $scope.unregisterFromConference = function () {
+    $scope.joinWaitlist = function () {
         $scope.loading = true;
-        gapi.client.conference.unregisterFromConference({
+        gapi.client.conference.joinConferenceWaitlist({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
+            $scope.$apply(function () {
+                $scope.loading = false;
+                if (resp.error) {
+                    // The request has failed.
+                    var errorMessage = resp.error.message || '';
+                    $scope.messages = 'Failed to join the waitlist : ' + errorMessage;
+                    $scope.alertStatus = 'warning';
+                    $log.error($scope.messages);
+
+                    if (resp.code && resp.code == HTTP_ERRORS.UNAUTHORIZED) {
+                        oauth2Provider.showLoginModal();
+                        return;
+                    }
+                } else {
+                    apiCache.invalidateAfter('joinConferenceWaitlist');
+                    $scope.waitlistPosition = resp.result.position;
+                    $scope.messages = 'You will be registered automatically when a seat frees up';
+                    $scope.alertStatus = 'info';
+                    $log.info($scope.messages);
+                }
+            });
+        });
+    };
+
+    /**
+     * Invokes the conference.unregisterForConference method.
+     */
+    $scope.unregisterFromConference = function () {
+        $scope.loading = true;
+        executeRegistration('unregisterFromConference', function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
@@ -691,7 +790,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
  * such as user authentications.
  *
  */
-conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider) {
+conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider, apiCache) {
 
     /**
      * Returns if the viewLocation is the currently viewed page.
@@ -717,7 +816,7 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
      */
     $scope.signIn = function () {
         oauth2Provider.signIn(function () {
-            gapi.client.oauth2.userinfo.get().execute(function (resp) {
+            oauth2Provider.identify(function (resp) {
                 $scope.$apply(function () {
                     if (resp.email) {
                         oauth2Provider.signedIn = true;
@@ -739,8 +838,10 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
             'callback': function () {
                 jQuery('#signInButton button').attr('disabled', 'true').css('cursor', 'default');
                 if (gapi.auth.getToken() && gapi.auth.getToken().access_token) {
-                    $scope.$apply(function () {
-                        oauth2Provider.signedIn = true;
+                    oauth2Provider.identify(function (resp) {
+                        $scope.$apply(function () {
+                            oauth2Provider.signedIn = !!resp.email;
+                        });
                     });
                 }
             },
@@ -755,6 +856,7 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
      */
     $scope.signOut = function () {
         oauth2Provider.signOut();
+        apiCache.clear();
         $scope.alertStatus = 'success';
         $scope.rootMessages = 'Logged out';
     };
@@ -781,7 +883,7 @@ conferenceApp.controllers.controller('OAuth2LoginModalCtrl',
     function ($scope, $modalInstance, $rootScope, oauth2Provider) {
         $scope.singInViaModal = function () {
             oauth2Provider.signIn(function () {
-                gapi.client.oauth2.userinfo.get().execute(function (resp) {
+                oauth2Provider.identify(function (resp) {
                     $scope.$root.$apply(function () {
                         oauth2Provider.signedIn = true;
                         $scope.$root.alertStatus = 'success';
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""
+test_benchmark.py -- tests of the benchmark harness, against the App Engine
+testbed stubs
+
+    $ APPENGINE_SDK=~/google-cloud-sdk/platform/google_appengine \\
+          python test_benchmark.py
+
+"""
+
+import os
+import unittest
+
+if os.environ.get('APPENGINE_SDK'):
+    from benchmark import setupPaths
+    setupPaths(os.environ['APPENGINE_SDK'])
+
+import benchmark
+import datagen
+
+
+class MeasureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tb = benchmark.activateTestbed()
+        self.dataset = datagen.generate(datagen.Config(
+            profiles=50, conferences=10, sessions=5, hot_conferences=1,
+            hot_registrants=20, wishlist_users=5, wishlist_length=10))
+        self.counter = benchmark.RpcCounter()
+
+    def tearDown(self):
+        self.counter.active = False
+        self.tb.deactivate()
+
+    def testRepeatedScenarioMakesTheSameRpcs(self):
+        import conference
+        api = conference.ConferenceApi()
+        CONF_GET = conference.CONF_GET_REQUEST.combined_message_class
+        wsck = self.dataset.hot_conference_keys[0].urlsafe()
+
+        def read(i):
+            api.getConference(CONF_GET(websafeConferenceKey=wsck))
+            benchmark.actAs(datagen.userId(0))
+            api.getConferenceSessionSchedule(
+                CONF_GET(websafeConferenceKey=wsck))
+
+        latencies, rpcs = benchmark.measure(read, 5, self.counter)
+        self.assertEqual(len(latencies), 5)
+        self.assertTrue(rpcs[0].get('datastore_v3'))
+        for counts in rpcs[1:]:
+            self.assertEqual(counts, rpcs[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+test_seatpush.py -- tests of the seat count coalescing, with LocalBroker
+
+    $ APPENGINE_SDK=~/google-cloud-sdk/platform/google_appengine \\
+          python test_seatpush.py
+
+"""
+
+import os
+import threading
+import time
+import unittest
+
+if os.environ.get('APPENGINE_SDK'):
+    from benchmark import setupPaths
+    setupPaths(os.environ['APPENGINE_SDK'])
+
+import seatpush
+
+
+class LocalBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.seats = {'conf': 10}
+        self.broker = seatpush.LocalBroker(load=self.seats.get)
+        self.old = seatpush.setBroker(self.broker)
+
+    def tearDown(self):
+        seatpush.setBroker(self.old)
+
+    def register(self, n=1):
+        for _ in range(n):
+            self.seats['conf'] -= 1
+            seatpush.publish('conf')
+
+    def testChangesAreCoalesced(self):
+        self.register(5)
+        self.assertEqual(self.broker.scheduled, set(['conf']))
+        updates = self.broker.flushPending()
+        self.assertEqual([u['seatsAvailable'] for u in updates], [5])
+        self.assertEqual(self.broker.flushPending(), [])
+
+    def testChangeDuringFlushIsDelivered(self):
+        self.register()
+
+        def load(wsck):
+            seats = self.seats[wsck]
+            # a registration commits after the flush has read the count
+            self.register()
+            return seats
+        self.broker.load = load
+        first = self.broker.flushPending()[0]
+        self.assertEqual(first['seatsAvailable'], 9)
+
+        self.broker.load = self.seats.get
+        second = self.broker.flushPending()[0]
+        self.assertEqual(second['seatsAvailable'], 8)
+        self.assertGreater(second['version'], first['version'])
+
+    def testPollWakesOnFlush(self):
+        self.register()
+        received = []
+        poller = threading.Thread(
+            target=lambda: received.append(seatpush.poll('conf', 0, 10)))
+        poller.start()
+        time.sleep(0.1)
+        started = time.time()
+        self.broker.flushPending()
+        poller.join()
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(received[0]['seatsAvailable'], 9)
+
+    def testPollReturnsOnlyNewerVersions(self):
+        self.register()
+        update = self.broker.flushPending()[0]
+        self.assertEqual(seatpush.poll('conf', 0, 0), update)
+        self.assertIsNone(seatpush.poll('conf', update['version'], 0.1))
+
+    def testMissingConferenceIsNotPublished(self):
+        seatpush.publish('gone')
+        self.assertEqual(self.broker.flushPending(), [None])
+        self.assertIsNone(seatpush.poll('gone', 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+test_sync.py -- tests of the sync tokens of syncConferenceSessions, against
+the App Engine testbed stubs
+
+    $ APPENGINE_SDK=~/google-cloud-sdk/platform/google_appengine \\
+          python test_sync.py
+
+"""
+
+import os
+import unittest
+
+if os.environ.get('APPENGINE_SDK'):
+    from benchmark import setupPaths
+    setupPaths(os.environ['APPENGINE_SDK'])
+
+from google.appengine.ext import ndb
+
+from benchmark import activateTestbed
+import conference
+from models import Conference
+from models import Profile
+from models import Session
+from tombstones import MICROSECONDS_PER_DAY
+
+SYNC = conference.SESSION_SYNC_REQUEST.combined_message_class
+
+
+class SyncTokenTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tb = activateTestbed()
+        ndb.get_context().set_cache_policy(False)
+        organizer = ndb.Key(Profile, 'organizer@example.com')
+        self.conf_key = Conference(parent=organizer, name='Conf').put()
+        self.session = Session(parent=self.conf_key, name='Talk')
+        self.session.put()
+        self.now = self.session.modified
+        self.old_syncTimestamp = conference.syncTimestamp
+        conference.syncTimestamp = lambda: self.now
+        self.api = conference.ConferenceApi()
+
+    def tearDown(self):
+        conference.syncTimestamp = self.old_syncTimestamp
+        self.tb.deactivate()
+
+    def sync(self, token):
+        return self.api.syncConferenceSessions(SYNC(
+            websafeConferenceKey=self.conf_key.urlsafe(),
+            syncToken=str(token) if token else None))
+
+    def later(self, days):
+        self.now += days * MICROSECONDS_PER_DAY
+
+    def testFirstSyncIsFull(self):
+        result = self.sync(None)
+        self.assertTrue(result.fullSync)
+        self.assertEqual([s.name for s in result.items], ['Talk'])
+
+    def testTokenAdvancesWithoutChanges(self):
+        token = self.session.modified
+        for _ in range(3):
+            # quiet for 20 days between syncs, 60 days in all
+            self.later(20)
+            result = self.sync(token)
+            self.assertFalse(result.fullSync)
+            self.assertEqual(result.items, [])
+            self.assertEqual(result.deletedKeys, [])
+            self.assertGreater(int(result.syncToken), token)
+            token = int(result.syncToken)
+
+    def testTokenStaysBehindRecentChanges(self):
+        result = self.sync(self.session.modified - 1)
+        self.assertEqual([s.name for s in result.items], ['Talk'])
+        # stamped within the margin, so the next sync sends it again
+        self.assertLess(int(result.syncToken), self.session.modified)
+
+    def testExpiredTokenGetsFullSync(self):
+        token = self.session.modified
+        self.later(40)
+        result = self.sync(token)
+        self.assertTrue(result.fullSync)
+        self.assertEqual([s.name for s in result.items], ['Talk'])
+
+
+if __name__ == '__main__':
+    unittest.main()
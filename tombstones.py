@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""
+tombstones.py -- pruning of the SessionTombstones left for syncing clients
+
+Deleting a Session leaves a SessionTombstone so syncConferenceSessions can
+report the delete. Tombstones are only needed until the clients have
+synced past them, so a daily cron job deletes those older than
+TOMBSTONE_TTL_DAYS. A client whose sync token is older than that gets a
+full sync instead, as it may have missed deletes.
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import SessionTombstone
+from models import syncTimestamp
+
+TOMBSTONE_TTL_DAYS = 30
+PRUNE_BATCH = 500   # tombstones deleted per datastore call
+MICROSECONDS_PER_DAY = 24 * 60 * 60 * 1000000
+
+
+def oldestSyncToken(now):
+    """Return the oldest sync token still covered by the tombstones."""
+    return now - TOMBSTONE_TTL_DAYS * MICROSECONDS_PER_DAY
+
+
+def pruneTombstones():
+    """Delete the expired tombstones; run by the prune cron job.
+
+    :return: number of tombstones deleted
+    """
+    query = SessionTombstone.query(
+            SessionTombstone.modified < oldestSyncToken(syncTimestamp()))
+    deleted = 0
+    cursor = None
+    more = True
+    while more:
+        # page with a cursor: the index may still list deleted tombstones
+        keys, cursor, more = query.fetch_page(
+                PRUNE_BATCH, start_cursor=cursor, keys_only=True)
+        ndb.delete_multi(keys)
+        deleted += len(keys)
+    return deleted
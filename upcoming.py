@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+upcoming.py -- the cached list of upcoming conferences
+
+The home page lists the conferences that have not started yet, soonest
+first. Rather than sorting the whole kind on every visit, the list is kept
+in cache.py as encoded ConferenceForms: a cron job rebuilds it every few
+minutes, creating or updating a conference drops it, and a read that finds
+it missing rebuilds it once for all instances. Registrations do not drop
+it, so its seatsAvailable counts can lag by up to one cron interval; the
+conference page itself shows the live count.
+
+"""
+
+from datetime import date
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+import cache
+from forms import conferenceForm
+from models import Conference
+from models import ConferenceForms
+from models import Profile
+
+MEMCACHE_UPCOMING_KEY = "UPCOMING_CONFERENCES"
+UPCOMING_TTL = 15 * 60  # the cron refreshes it every 10 minutes
+UPCOMING_MAX = 200      # conferences kept in the list
+
+
+def _load():
+    """Query the upcoming conferences and return them encoded."""
+    conferences = Conference.query(
+            Conference.startDate >= date.today()
+    ).order(Conference.startDate, Conference.name).fetch(UPCOMING_MAX)
+
+    organisers = set(ndb.Key(Profile, conf.organizerUserId)
+                     for conf in conferences)
+    names = dict((prof.key.id(), prof.displayName)
+                 for prof in ndb.get_multi(list(organisers)) if prof)
+
+    return protojson.encode_message(ConferenceForms(
+            items=[conferenceForm(conf, names.get(conf.organizerUserId))
+                   for conf in conferences]))
+
+
+def rebuild():
+    """Recompute the list and cache it; run by the upcoming cron job."""
+    cache.put(MEMCACHE_UPCOMING_KEY, _load(), UPCOMING_TTL)
+
+
+def invalidate():
+    """Drop the list after a conference was created or changed."""
+    cache.invalidate(MEMCACHE_UPCOMING_KEY)
+
+
+def getUpcoming(days=None):
+    """
+        Return the upcoming conferences as ConferenceForms, soonest first.
+
+    :param days: if given, only the conferences starting within that many
+                 days from today
+    :return: ConferenceForms
+    """
+    forms = protojson.decode_message(ConferenceForms, cache.getOrCompute(
+            MEMCACHE_UPCOMING_KEY, _load, UPCOMING_TTL))
+    today = date.today().isoformat()
+    last = (date.today() + timedelta(days=days)).isoformat() \
+        if days is not None else None
+    # the list may be up to one refresh old, so drop what started since
+    forms.items = [form for form in forms.items
+                   if form.startDate >= today and
+                   (last is None or form.startDate <= last)]
+    return forms
@@ -5,6 +5,7 @@ import uuid
 
 from google.appengine.api import urlfetch
 from models import Profile
+from validation import normalizeTime
 
 
 def getUserId(user, id_type="email"):
@@ -53,30 +54,4 @@ def validateTime(time):
     :param time: the inputted time from the user
     :return: the time the user entered, or 0
     """
-    response = time
-    if  (time > 59 and time < 100) or \
-        (time > 159 and time < 200) or \
-        (time > 259 and time < 300) or \
-        (time > 359 and time < 400) or \
-        (time > 459 and time < 500) or \
-        (time > 559 and time < 600) or \
-        (time > 659 and time < 700) or \
-        (time > 759 and time < 800) or \
-        (time > 859 and time < 900) or \
-        (time > 959 and time < 1000) or \
-        (time > 1059 and time < 1100) or \
-        (time > 1159 and time < 1200) or \
-        (time > 1259 and time < 1300) or \
-        (time > 1359 and time < 1400) or \
-        (time > 1459 and time < 1500) or \
-        (time > 1559 and time < 1600) or \
-        (time > 1659 and time < 1700) or \
-        (time > 1759 and time < 1800) or \
-        (time > 1859 and time < 1900) or \
-        (time > 1959 and time < 2000) or \
-        (time > 2059 and time < 2100) or \
-        (time > 2159 and time < 2200) or \
-        (time > 2259 and time < 2300) or \
-        (time > 2359):
-            response = 0
-    return response
+    return normalizeTime(time)
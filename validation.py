@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""
+validation.py -- batch validation of session times and date strings
+
+Times are HHMM integers; one is invalid when it is past 2359 or its minutes
+are 60 or more, which is checked arithmetically for a whole column at once.
+Date columns ('YYYY-MM-DD', anything after the 10th character is ignored)
+are parsed in bulk. Zero-padded dates take a fast path; anything else goes
+through datetime.strptime, so what createConference always accepted (e.g.
+'2016-6-1') still parses. Both use NumPy when it is installed and fall back to
+plain Python otherwise; each returns a per-row error mask next to the
+values, so one bad row does not reject a whole batch.
+
+"""
+
+import re
+from datetime import date
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+
+
+def _timeInvalid(t):
+    return t is not None and (t > 2359 or (t >= 0 and t % 100 >= 60))
+
+
+def invalidTimes(times):
+    """
+        Check a column of HHMM times.
+
+    :param times: list of ints (None is allowed and counts as valid)
+    :return: list of bools, True where the time is invalid
+    """
+    if np is None or not times:
+        return [_timeInvalid(t) for t in times]
+    present = np.array([t is not None for t in times])
+    values = np.array([t if t is not None else 0 for t in times],
+                      dtype=np.int64)
+    invalid = present & ((values > 2359) |
+                         ((values >= 0) & (values % 100 >= 60)))
+    return invalid.tolist()
+
+
+def normalizeTimes(times):
+    """
+        Replace the invalid times of a column by 0, the way a single
+        start_time has always been normalized.
+
+    :param times: list of HHMM ints or None
+    :return: (list of normalized times, list of bools marking the invalid
+              rows)
+    """
+    invalid = invalidTimes(times)
+    return [0 if bad else t for t, bad in zip(times, invalid)], invalid
+
+
+def normalizeTime(t):
+    """Single value version of normalizeTimes()."""
+    return 0 if _timeInvalid(t) else t
+
+
+def _parseOne(value, cache):
+    """Parse one date string, or return None if it is not a valid date."""
+    value = value[:10]
+    if value not in cache:
+        match = DATE_RE.match(value)
+        try:
+            if match:
+                cache[value] = date(*[int(g) for g in match.groups()])
+            else:
+                cache[value] = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            cache[value] = None
+    return cache[value]
+
+
+def parseDates(values):
+    """
+        Parse a column of 'YYYY-MM-DD' date strings.
+
+    :param values: list of strings; empty values and None are left as None
+                   and are not errors
+    :return: (list of datetime.date or None, list of bools marking the rows
+              that could not be parsed)
+    """
+    dates = [None] * len(values)
+    errors = [False] * len(values)
+    rows = [i for i, value in enumerate(values) if value]
+    if np is not None and rows:
+        texts = [values[i][:10] for i in rows]
+        if all(DATE_RE.match(t) for t in texts):
+            try:
+                parsed = np.array(texts, dtype='datetime64[D]')
+            except ValueError:
+                pass        # some row is out of range, sort it out below
+            else:
+                for i, day in zip(rows, parsed.astype(object)):
+                    dates[i] = day
+                return dates, errors
+    # bulk uploads repeat the same few dates, so parse each one only once
+    cache = {}
+    for i in rows:
+        dates[i] = _parseOne(values[i], cache)
+        errors[i] = dates[i] is None
+    return dates, errors
+
+
+def parseDate(value):
+    """
+        Parse a single 'YYYY-MM-DD' date string, with the semantics of
+        datetime.strptime(value[:10], '%Y-%m-%d').
+
+    :param value: the string; anything after the 10th character is ignored
+    :return: datetime.date
+    :raise ValueError: if value is not a valid date
+    """
+    parsed = _parseOne(value, {})
+    if parsed is None:
+        raise ValueError("'%s' is not a YYYY-MM-DD date" % value)
+    return parsed
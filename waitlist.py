@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+waitlist.py -- registration waitlists for full conferences
+
+Users queue for a full conference with a WaitlistEntry, a child of their
+Profile keyed by the websafeConferenceKey, so joining never touches the
+conference's entity group. When seats free up a task promotes the oldest
+entries in batches, each batch in one cross-group transaction.
+
+A seat freed by an unregistration is held for the waitlist (heldSeats on
+the Conference, counted in the same transaction), so a direct registration
+can't take it before the promotion task runs. The waitlist query is
+eventually consistent and may not show an entry that was just added, so
+when it comes back empty while seats are free the task looks again a few
+times before it releases the held seats to direct registrations.
+
+"""
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import WaitlistEntry
+import cache
+import seatpush
+
+PROMOTE_URL = '/tasks/promote_waitlist'
+# an xg transaction spans at most 25 entity groups: the conference plus
+# one Profile group (holding its WaitlistEntry) per promoted user
+PROMOTION_BATCH = 24
+EMPTY_RECHECKS = 3      # looks at an empty queue before releasing holds
+RECHECK_SECONDS = 5
+
+
+def entryKey(user_id, wsck):
+    """Return the key of a user's WaitlistEntry for a conference."""
+    return ndb.Key(Profile, user_id, WaitlistEntry, wsck)
+
+
+def queueQuery(wsck):
+    """Return the query of a conference's waitlist, oldest first."""
+    return WaitlistEntry.query(
+            WaitlistEntry.conference == wsck).order(WaitlistEntry.created)
+
+
+def position(entry):
+    """Return the 1-based position of an entry in its waitlist."""
+    return WaitlistEntry.query(
+            WaitlistEntry.conference == entry.conference,
+            WaitlistEntry.created < entry.created).count() + 1
+
+
+def enqueuePromotion(wsck, transactional=False, attempt=0, countdown=0):
+    """Add a task promoting the waitlist of a conference."""
+    taskqueue.add(params={'wsck': wsck, 'attempt': attempt},
+                  url=PROMOTE_URL, countdown=countdown,
+                  transactional=transactional)
+
+
+@ndb.transactional(xg=True)
+def _promoteBatch(conf_key, entry_keys):
+    """
+        Register the users of the given waitlist entries while seats last.
+
+    :return: (number of users promoted, seats left afterwards)
+    """
+    conf = conf_key.get()
+    if not conf:
+        return 0, 0
+    wsck = conf_key.urlsafe()
+    entries = [e for e in ndb.get_multi(entry_keys) if e]
+    profiles = ndb.get_multi([e.key.parent() for e in entries])
+
+    promoted = []
+    done = []
+    for entry, prof in zip(entries, profiles):
+        if conf.seatsAvailable <= 0:
+            break
+        done.append(entry.key)
+        if prof is None or wsck in prof.conferenceKeysToAttend:
+            continue
+        prof.conferenceKeysToAttend.append(wsck)
+        conf.seatsAvailable -= 1
+        conf.heldSeats = max((conf.heldSeats or 0) - 1, 0)
+        promoted.append(prof)
+
+    ndb.put_multi(promoted + [conf])
+    ndb.delete_multi(done)
+    return len(promoted), conf.seatsAvailable
+
+
+@ndb.transactional()
+def _releaseHeldSeats(conf_key):
+    """Let direct registrations have the seats held for the waitlist."""
+    conf = conf_key.get()
+    if conf and conf.heldSeats:
+        conf.heldSeats = 0
+        conf.put()
+
+
+def promoteWaitlist(wsck, attempt=0):
+    """
+        Promote the oldest waitlisted users of a conference into its free
+        seats, one batch per call; another task is queued while both free
+        seats and waiting users remain.
+
+    :param wsck: websafeConferenceKey of the conference
+    :param attempt: the number of times the queue was found empty so far
+    :return: number of users promoted
+    """
+    conf_key = ndb.Key(urlsafe=wsck)
+    entry_keys = queueQuery(wsck).fetch(PROMOTION_BATCH, keys_only=True)
+    promoted = 0
+    if entry_keys:
+        promoted, seats_left = _promoteBatch(conf_key, entry_keys)
+        if promoted:
+            cache.invalidateConference(wsck)
+            seatpush.publish(wsck)
+        if seats_left > 0 and len(entry_keys) == PROMOTION_BATCH:
+            enqueuePromotion(wsck)
+            return promoted
+    else:
+        conf = conf_key.get()
+        seats_left = conf.seatsAvailable if conf else 0
+
+    if seats_left > 0:
+        # the queue looks empty, but may not show the newest entries yet
+        if attempt < EMPTY_RECHECKS:
+            enqueuePromotion(wsck, attempt=attempt + 1,
+                             countdown=RECHECK_SECONDS)
+        else:
+            _releaseHeldSeats(conf_key)
+    return promoted
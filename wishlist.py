@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+wishlist.py -- interval bookkeeping for a user's wishlisted sessions
+
+Profile.wishlistSchedule maps a "<websafeConferenceKey>|<date>" bucket to
+the wishlisted sessions of that conference day, as a list of
+[start, end, websafeSessionKey, maxEnd] entries sorted by start. Times are
+minutes since midnight and maxEnd is the latest end of the entries up to
+and including that one, which lets an overlap lookup stop early. A bucket
+holds one conference day, so it stays small; adding to it is linear in its
+size anyway, as the sorted list is updated in place.
+
+"""
+
+from bisect import bisect_left
+from bisect import insort
+
+from google.appengine.ext import ndb
+
+START, END, KEY, MAX_END = range(4)
+
+
+def minutes(hhmm):
+    """Convert an HHMM integer to minutes since midnight."""
+    hhmm = hhmm or 0
+    return (hhmm // 100) * 60 + hhmm % 100
+
+
+def bucketFor(session):
+    """Return the schedule bucket of a Session: its conference and day."""
+    return '%s|%s' % (session.key.parent().urlsafe(), session.date)
+
+
+def intervalFor(session):
+    """Return the (start, end) minutes of a Session."""
+    start = minutes(session.start_time)
+    return start, start + (session.duration or 0)
+
+
+def _refreshMaxEnd(entries, first=0):
+    """Recompute the running maxEnd of entries from position first on."""
+    max_end = entries[first - 1][MAX_END] if first else None
+    for entry in entries[first:]:
+        max_end = entry[END] if max_end is None else max(max_end, entry[END])
+        entry[MAX_END] = max_end
+
+
+def overlapping(entries, start, end):
+    """
+        Return the websafe keys of the entries overlapping [start, end).
+
+        Binary search finds the last entry starting before end; walking back
+        from there stops as soon as no earlier entry can still be running.
+        That is usually a few entries past the overlaps found, but the
+        worst case is O(n): one long early session keeps maxEnd high and
+        the walk goes back to it.
+    """
+    found = []
+    i = bisect_left(entries, [end]) - 1
+    while i >= 0 and entries[i][MAX_END] > start:
+        if entries[i][END] > start:
+            found.append(entries[i][KEY])
+        i -= 1
+    return found
+
+
+def addSession(schedule, session):
+    """
+        Add a Session to a wishlist schedule.
+
+    :param schedule: the Profile.wishlistSchedule dict, updated in place
+    :param session: the Session being wishlisted
+    :return: websafe keys of the wishlisted sessions it overlaps with
+    """
+    entries = schedule.setdefault(bucketFor(session), [])
+    start, end = intervalFor(session)
+    wssk = session.key.urlsafe()
+    conflicts = [k for k in overlapping(entries, start, end) if k != wssk]
+    entry = [start, end, wssk, end]
+    insort(entries, entry)
+    _refreshMaxEnd(entries, entries.index(entry))
+    return conflicts
+
+
+def removeSession(schedule, session):
+    """Remove a Session from a wishlist schedule, if it is there."""
+    bucket = bucketFor(session)
+    entries = schedule.get(bucket, [])
+    wssk = session.key.urlsafe()
+    for i, entry in enumerate(entries):
+        if entry[KEY] == wssk:
+            del entries[i]
+            _refreshMaxEnd(entries, i)
+            break
+    if not entries:
+        schedule.pop(bucket, None)
+
+
+def buildSchedule(sessions):
+    """Build a wishlist schedule from Session entities."""
+    schedule = {}
+    for session in sessions:
+        if session:
+            addSession(schedule, session)
+    return schedule
+
+
+def ensureSchedule(prof):
+    """
+        Return the wishlist schedule of a Profile, building it from the
+        wishlisted sessions the first time for profiles that predate it.
+    """
+    if prof.wishlistSchedule is None:
+        prof.wishlistSchedule = buildSchedule(ndb.get_multi(
+                [ndb.Key(urlsafe=wssk) for wssk in prof.sessionKeysInWishlist]))
+    return prof.wishlistSchedule
+
+
+def allConflicts(schedule):
+    """
+        Return every pair of overlapping sessions in a wishlist schedule as
+        (websafeSessionKey, websafeSessionKey) tuples, using a sweep over
+        each (already sorted) bucket.
+    """
+    pairs = []
+    for entries in schedule.values():
+        running = []
+        for start, end, wssk, _ in entries:
+            running = [(e, k) for e, k in running if e > start]
+            pairs.extend((k, wssk) for e, k in running)
+            running.append((end, wssk))
+    return pairs